@@ -12,6 +12,8 @@ import time
 from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
+from fs_catalog import catalog_for
+from partitions import drop_expired_partitions, undated_paths
 
 # Load environment variables
 load_dotenv()
@@ -49,11 +51,10 @@ def get_directory_size(directory):
     """Calculate total size of directory in MB"""
     total_size = 0
     try:
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                if os.path.exists(filepath):
-                    total_size += os.path.getsize(filepath)
+        # .git counts towards storage too; hardlinks into the media store are counted once
+        catalog = catalog_for(directory, include_hidden=True)
+        catalog.refresh()
+        total_size = catalog.total_size(under=directory, hidden=True)
     except Exception as e:
         logger.error(f"Error calculating size for {directory}: {str(e)}")
     return total_size / (1024 * 1024)  # Convert to MB
@@ -69,24 +70,43 @@ def cleanup_old_files(directory, days_old=7):
     cutoff_date = datetime.now() - timedelta(days=days_old)
     
     try:
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-                    if file_mtime < cutoff_date:
-                        file_size = os.path.getsize(file_path)
-                        os.remove(file_path)
-                        removed_count += 1
-                        removed_size += file_size
-                        logger.info(f"Removed old file: {file_path}")
-                except Exception as e:
-                    logger.error(f"Error removing file {file_path}: {str(e)}")
+        # Files inside dot-directories (e.g. .git objects) are never expired here
+        catalog = catalog_for(directory)
+        catalog.refresh()
+        for entry in catalog.older_than(cutoff_date.timestamp(), under=directory):
+            try:
+                os.remove(entry.path)
+                catalog.discard(entry.path)
+                removed_count += 1
+                removed_size += entry.size
+                logger.info(f"Removed old file: {entry.path}")
+            except Exception as e:
+                logger.error(f"Error removing file {entry.path}: {str(e)}")
     except Exception as e:
         logger.error(f"Error walking directory {directory}: {str(e)}")
     
     return removed_count, removed_size / (1024 * 1024)  # Size in MB
 
+def cleanup_download_partitions(download_dir, days_old=7):
+    """Drop whole <user>/<date> partitions past retention; undated folders go by file age"""
+    if not os.path.exists(download_dir):
+        logger.warning(f"Directory {download_dir} does not exist")
+        return 0, 0
+    
+    catalog = catalog_for(download_dir)
+    catalog.refresh()
+    removed_count, removed_size = drop_expired_partitions(download_dir, days_old, catalog=catalog)
+    removed_size /= (1024 * 1024)
+    logger.info(f"Dropped expired date partitions: {removed_count} files, {removed_size:.2f} MB")
+    
+    # e.g. <user>/highlights/ has no date in its path
+    for path in undated_paths(download_dir):
+        count, size = cleanup_old_files(path, days_old=days_old)
+        removed_count += count
+        removed_size += size
+    
+    return removed_count, removed_size  # Size in MB
+
 def cleanup_zip_files(max_age_hours=24):
     """Remove zip files older than specified hours"""
     removed_count = 0
@@ -134,6 +154,19 @@ def cleanup_git_objects(repo_path):
     except Exception as e:
         logger.error(f"Error during git cleanup: {str(e)}")
 
+def cleanup_media_store():
+    """Remove stored media no longer linked from the downloads tree"""
+    media_store_dir = os.getenv('MEDIA_STORE_DIR', 'media_store')
+    if not os.path.exists(media_store_dir):
+        return 0, 0
+    try:
+        from media_store import MediaStore
+        count, freed = MediaStore(media_store_dir).gc()
+        return count, freed / (1024 * 1024)  # Size in MB
+    except Exception as e:
+        logger.error(f"Error collecting media store {media_store_dir}: {str(e)}")
+        return 0, 0
+
 def daily_cleanup():
     """Perform daily cleanup operations"""
     logger.info("Starting daily cleanup process")
@@ -148,11 +181,17 @@ def daily_cleanup():
     
     # Clean old download files (keep for 5 days)
     if os.path.exists(download_dir):
-        count, size = cleanup_old_files(download_dir, days_old=5)
+        count, size = cleanup_download_partitions(download_dir, days_old=5)
         total_removed_files += count
         total_freed_space += size
         logger.info(f"Cleaned {count} old download files, freed {size:.2f} MB")
     
+    # Drop media blobs whose last user/date link was just removed
+    count, size = cleanup_media_store()
+    total_removed_files += count
+    total_freed_space += size
+    logger.info(f"Collected {count} unreferenced media blobs, freed {size:.2f} MB")
+    
     # Clean old log files (keep for 3 days)
     if os.path.exists('logs'):
         count, size = cleanup_old_files('logs', days_old=3)
@@ -188,9 +227,12 @@ def emergency_cleanup():
     
     # Keep only 2 days of downloads
     if os.path.exists(download_dir):
-        count, size = cleanup_old_files(download_dir, days_old=2)
+        count, size = cleanup_download_partitions(download_dir, days_old=2)
         logger.info(f"Emergency: Cleaned {count} files, freed {size:.2f} MB from downloads")
     
+    count, size = cleanup_media_store()
+    logger.info(f"Emergency: Collected {count} media blobs, freed {size:.2f} MB")
+    
     # Keep only 1 day of logs
     if os.path.exists('logs'):
         count, size = cleanup_old_files('logs', days_old=1)
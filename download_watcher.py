@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Event-driven download watcher for snap-tracker
+Uses Linux inotify (through ctypes) to learn about finished files as soon as
+they are written or renamed into DOWNLOAD_DIR, and a persisted snapshot of
+already-notified files so anything that arrived while the monitor was down
+is picked up on the next start
+"""
+
+import os
+import json
+import time
+import errno
+import select
+import struct
+import ctypes
+import threading
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from logger_config import system_logger, log_error_with_context
+from partitions import parse_partition, active_dates
+from metadata_store import SEGMENT_NAME
+
+# Load environment variables
+load_dotenv()
+
+# Kept outside logs/ so log retention never resets it
+MONITOR_SNAPSHOT = os.getenv('MONITOR_SNAPSHOT', 'data/monitor_snapshot.json')
+
+# Quiet period that closes a batch, and the longest a batch may stay open
+DEBOUNCE_SECONDS = float(os.getenv('MONITOR_DEBOUNCE', '5'))
+MAX_BATCH_DELAY = 60.0
+
+# In-progress downloads, renamed into place once complete
+PARTIAL_SUFFIX = '.part'
+
+# inotify(7) flags
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def _ignored(name):
+    # Metadata segments are pushed to git but are not downloads to report
+    return name.startswith('.') or name.endswith(PARTIAL_SUFFIX) or name == SEGMENT_NAME
+
+
+class Inotify:
+    """Minimal inotify binding: one fd, watches keyed by watch descriptor."""
+
+    def __init__(self):
+        # CDLL(None) resolves against the running process, so this works with glibc and musl alike
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = path
+        return wd
+
+    def read_events(self):
+        """Yield (directory, name, mask) for every queued event"""
+        while True:
+            try:
+                buf = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    continue
+                yield self.paths.get(wd), name, mask
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DownloadWatcher:
+    """Reports files that completed under root since they were last notified."""
+
+    def __init__(self, root, snapshot_file=MONITOR_SNAPSHOT, debounce=DEBOUNCE_SECONDS):
+        self.root = root
+        self.snapshot_file = snapshot_file
+        self.debounce = debounce
+        # Relative paths already notified, paths handed out but not yet marked
+        # notified, and completed paths not yet handed out
+        self.known = set()
+        self.reported = set()
+        self.pending = set()
+        self._needs_rescan = False
+        # mark_notified is called from the notification worker
+        self._lock = threading.Lock()
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            # Not Linux (or no inotify in this kernel): fall back to periodic scans
+            system_logger.warning(f"WATCHER: inotify unavailable ({e}), falling back to directory scans")
+            self._inotify = None
+
+    @property
+    def event_driven(self):
+        return self._inotify is not None
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.root)
+
+    def _scan(self, top, watch=False, since=None):
+        """Relative paths of all completed files under top, optionally adding watches
+
+        :param since: skip date partitions older than this date (they are sealed)
+        """
+        found = set()
+        stack = [top]
+        oldest_open = min(active_dates())
+        while stack:
+            directory = stack.pop()
+            day = parse_partition(os.path.basename(directory))
+            if since is not None and day is not None and day < since:
+                continue
+            # Sealed partitions are listed (baseline) but never need a watch
+            if watch and (day is None or day >= oldest_open):
+                try:
+                    self._inotify.add_watch(directory)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        system_logger.error("WATCHER: Out of inotify watches, raise fs.inotify.max_user_watches")
+                    elif e.errno != errno.ENOENT:
+                        log_error_with_context(system_logger, e, f"Watching {directory}")
+                    continue
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if _ignored(entry.name):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            found.add(self._relative(entry.path))
+            except FileNotFoundError:
+                continue
+        return found
+
+    def _carry_sealed(self, paths, since):
+        """Known paths in partitions older than since whose partition still exists"""
+        carried = set()
+        partitions = {}
+        for path in paths:
+            directory = os.path.dirname(path)
+            day = parse_partition(os.path.basename(directory))
+            if day is None or day >= since:
+                continue
+            if directory not in partitions:
+                partitions[directory] = os.path.isdir(os.path.join(self.root, directory))
+            if partitions[directory]:
+                carried.add(path)
+        return carried
+
+    def _current(self, since, watch=False):
+        """Files on disk, listing only partitions that could have changed since the given date"""
+        return self._scan(self.root, watch=watch, since=since) | self._carry_sealed(self.known, since)
+
+    def _load_snapshot(self):
+        """Return (notified files, unix time saved), or (None, None) without a usable snapshot"""
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                data = json.load(f)
+            return set(data.get('files', [])), data.get('saved_at', 0)
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError) as e:
+            log_error_with_context(system_logger, e, f"Loading {self.snapshot_file}")
+            return None, None
+
+    def save_snapshot(self):
+        """Atomically persist the set of notified files"""
+        try:
+            if os.path.dirname(self.snapshot_file):
+                os.makedirs(os.path.dirname(self.snapshot_file), exist_ok=True)
+            tmp_path = self.snapshot_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'root': self.root, 'saved_at': int(time.time()), 'files': sorted(self.known)}, f,
+                          separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_file)
+        except OSError as e:
+            log_error_with_context(system_logger, e, f"Saving {self.snapshot_file}")
+
+    def reconcile(self):
+        """Walk the tree once, set up watches and return files missed while down
+
+        Without a snapshot (first run) the current tree becomes the baseline.
+        Only partitions that were still open when the snapshot was saved are
+        listed; older ones cannot have received files since.
+        """
+        snapshot, saved_at = self._load_snapshot()
+        if snapshot is None:
+            self.known = self._scan(self.root, watch=self.event_driven)
+            current = self.known
+            self.save_snapshot()
+            system_logger.info(f"WATCHER: No snapshot yet, baseline of {len(current)} files")
+            return []
+        self.known = snapshot
+        since = min(active_dates(datetime.fromtimestamp(saved_at, timezone.utc)))
+        current = self._current(since, watch=self.event_driven)
+        self.known = snapshot & current
+        missed = current - snapshot
+        system_logger.info(
+            f"WATCHER: Reconciled {len(current)} files against snapshot, {len(missed)} arrived while down"
+            + (f", watching {len(self._inotify.paths)} directories" if self.event_driven else "")
+        )
+        return [os.path.join(self.root, path) for path in sorted(missed)]
+
+    def _seen(self, relative):
+        """True for paths already handed out; a rewrite in place (e.g. the media
+        store swapping a file for a hardlink) must not report them again"""
+        return relative in self.known or relative in self.reported
+
+    def _handle(self, directory, name, mask):
+        if mask & IN_Q_OVERFLOW:
+            system_logger.warning("WATCHER: inotify queue overflowed, rescanning")
+            self._needs_rescan = True
+            return
+        if directory is None or mask & (IN_DELETE_SELF | IN_MOVE_SELF) or _ignored(name):
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # New user/date directory: watch it and catch files written before the watch existed
+                for relative in self._scan(path, watch=True):
+                    if not self._seen(relative):
+                        self.pending.add(relative)
+            return
+        relative = self._relative(path)
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            if not self._seen(relative):
+                self.pending.add(relative)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.pending.discard(relative)
+            self.known.discard(relative)
+            self.reported.discard(relative)
+
+    def _drain(self, timeout):
+        """Wait up to timeout for inotify events and process them; False on timeout"""
+        poller = select.poll()
+        poller.register(self._inotify.fd, select.POLLIN)
+        if not poller.poll(max(0, timeout) * 1000):
+            return False
+        with self._lock:
+            for directory, name, mask in self._inotify.read_events():
+                self._handle(directory, name, mask)
+        return True
+
+    def wait_for_files(self, timeout):
+        """Block until new files settle or timeout passes
+
+        :return: absolute paths of completed files not yet notified (may be empty)
+        """
+        if not self.event_driven:
+            time.sleep(timeout)
+            self._needs_rescan = True
+        else:
+            deadline = time.monotonic() + timeout
+            while not self.pending and not self._needs_rescan:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._drain(remaining):
+                    break
+            if self.pending:
+                # Debounce: keep collecting until the writers go quiet
+                batch_deadline = time.monotonic() + MAX_BATCH_DELAY
+                while time.monotonic() < batch_deadline and self._drain(self.debounce):
+                    pass
+
+        with self._lock:
+            if self._needs_rescan:
+                self._needs_rescan = False
+                current = self._current(min(active_dates()))
+                self.known &= current
+                self.reported &= current
+                self.pending = (self.pending & current) | (current - self.known - self.reported)
+
+            # A file can be removed again before we get to it
+            ready = [path for path in sorted(self.pending)
+                     if not self._seen(path) and os.path.exists(os.path.join(self.root, path))]
+            self.pending.clear()
+            self.reported.update(ready)
+        return [os.path.join(self.root, path) for path in ready]
+
+    def mark_notified(self, paths):
+        """Remember paths as handled and persist the snapshot"""
+        with self._lock:
+            relative = {self._relative(path) for path in paths}
+            self.known.update(relative)
+            self.reported.difference_update(relative)
+            self.save_snapshot()
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Structured downloader events for snap-tracker
+The downloader publishes JSON lines (user started, snap discovered, file
+completed, user failed, ...) on a local Unix socket; any number of other
+processes can subscribe instead of scraping log lines
+"""
+
+import os
+import json
+import time
+import select
+import socket
+import threading
+from dotenv import load_dotenv
+from logger_config import system_logger, log_error_with_context
+
+# Load environment variables
+load_dotenv()
+
+EVENTS_SOCKET = os.getenv('EVENTS_SOCKET', 'data/events.sock')
+
+# Event types
+USER_STARTED = 'user_started'
+SNAP_DISCOVERED = 'snap_discovered'
+FILE_COMPLETED = 'file_completed'
+USER_FAILED = 'user_failed'
+USER_FINISHED = 'user_finished'
+
+# Unsent bytes kept per subscriber before it starts missing events
+MAX_CLIENT_BUFFER = 1024 * 1024
+
+
+class EventPublisher:
+    """Broadcast JSON line events to every connected subscriber.
+
+    Each subscriber has its own buffer of unsent bytes that an I/O thread
+    drains as the socket becomes writable, so a slow reader never receives
+    half a line. A subscriber whose buffer is full misses events until it
+    catches up.
+    """
+
+    def __init__(self, path=EVENTS_SOCKET):
+        self.path = path
+        self._clients = {}
+        self._lagging = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)  # Stale socket from a previous run
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(8)
+        # Wakes the I/O thread when publish() leaves bytes behind
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        threading.Thread(target=self._io_loop, name='event-publisher', daemon=True).start()
+        system_logger.info(f"EVENTS: Publishing on {path}")
+
+    def _io_loop(self):
+        while not self._closed:
+            with self._lock:
+                writers = [client for client, pending in self._clients.items() if pending]
+            try:
+                readable, writable, _ = select.select([self._server, self._wake_r], writers, [], 1.0)
+            except (OSError, ValueError):
+                continue  # A socket was closed meanwhile
+            if self._wake_r in readable:
+                try:
+                    while self._wake_r.recv(4096):
+                        pass
+                except (BlockingIOError, OSError):
+                    pass
+            if self._server in readable:
+                try:
+                    client, _ = self._server.accept()
+                except OSError:
+                    return  # Server socket closed
+                client.setblocking(False)
+                with self._lock:
+                    self._clients[client] = bytearray()
+                system_logger.debug(f"EVENTS: Subscriber connected ({len(self._clients)} total)")
+            with self._lock:
+                for client in writable:
+                    self._flush(client)
+
+    def _flush(self, client):
+        """Send as much of a subscriber's buffer as its socket takes (lock held)"""
+        pending = self._clients.get(client)
+        if not pending:
+            return
+        try:
+            sent = client.send(pending)
+            del pending[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            del self._clients[client]
+            self._lagging.discard(client)
+            client.close()
+            system_logger.debug("EVENTS: Subscriber disconnected")
+
+    def publish(self, event, **fields):
+        """Queue one event for all subscribers and send what fits right away"""
+        fields['event'] = event
+        fields['time'] = time.time()
+        line = (json.dumps(fields, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock:
+            for client, pending in list(self._clients.items()):
+                if len(pending) + len(line) > MAX_CLIENT_BUFFER:
+                    if client not in self._lagging:
+                        self._lagging.add(client)
+                        system_logger.warning("EVENTS: A subscriber fell behind, skipping events until it catches up")
+                    continue
+                self._lagging.discard(client)
+                pending += line
+                self._flush(client)
+            backlog = any(self._clients.values())
+        if backlog:
+            try:
+                self._wake_w.send(b'\0')
+            except (BlockingIOError, OSError):
+                pass
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = {}
+        self._server.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def subscribe(path=EVENTS_SOCKET, reconnect_delay=5):
+    """Yield events from the publisher forever, reconnecting when it restarts"""
+    while True:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+                system_logger.info(f"EVENTS: Subscribed to {path}")
+                with sock.makefile('r', encoding='utf-8') as stream:
+                    for line in stream:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+        except OSError as e:
+            log_error_with_context(system_logger, e, f"Reading events from {path}")
+        time.sleep(reconnect_delay)
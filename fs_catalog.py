@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Shared filesystem catalog for snap-tracker
+Keeps an incremental, scandir-based index of path, size, mtime and inode so
+the monitor, git pusher, cleanup manager and zip helper stop walking and
+stat-ing the same tree over and over
+"""
+
+import os
+import time
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+from logger_config import system_logger
+from partitions import is_sealed
+
+# Files written this recently are re-stat'ed on refresh even if their
+# directory did not change (e.g. snaps.jsonl segments being appended to)
+HOT_SECONDS = 24 * 60 * 60
+
+# Directory mtimes this fresh are not trusted (coarse timestamp granularity)
+MTIME_SETTLE_NS = 2 * 1000 ** 3
+
+# Sealed partitions are only re-listed when a directory mtime changes; a
+# periodic full refresh also catches files rewritten in place by hand
+FULL_REFRESH_SECONDS = 24 * 60 * 60
+
+# In-progress downloads, renamed into place once complete
+PARTIAL_SUFFIX = '.part'
+
+FileEntry = namedtuple('FileEntry', 'path size mtime_ns dev inode nlink')
+
+
+class _DirNode:
+    """Cached listing of one directory: files as (size, mtime_ns, dev, inode, nlink)."""
+
+    __slots__ = ('mtime_ns', 'files', 'subdirs', 'hidden')
+
+    def __init__(self, hidden):
+        self.mtime_ns = None
+        self.files = {}
+        self.subdirs = set()
+        self.hidden = hidden
+
+
+class FsCatalog:
+    """Incremental index of every completed file under root."""
+
+    def __init__(self, root, include_hidden=False):
+        self.root = os.path.normpath(root)
+        self.abs_root = os.path.abspath(root)
+        # Whether dot-directories (.git, ...) are indexed at all
+        self.include_hidden = include_hidden
+        self._nodes = {}
+        self._lock = threading.RLock()
+        self.refreshed_at = None
+        self.full_refreshed_at = None
+
+    def refresh(self, full=False):
+        """Bring the index up to date
+
+        Directories whose mtime did not change keep their listing and only
+        re-stat recently written files. Inside sealed date partitions (older
+        than yesterday, UTC) each directory costs a single stat and is only
+        re-listed when its mtime changes, so the cost stays flat as history
+        grows. full=True re-lists everything; that also happens once every
+        FULL_REFRESH_SECONDS.
+
+        :return: (directories listed, files stat'ed)
+        """
+        listed = 0
+        stated = 0
+        now_ns = time.time_ns()
+        hot_cutoff = now_ns - HOT_SECONDS * 1000 ** 3
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            if self.full_refreshed_at is None or time.time() - self.full_refreshed_at >= FULL_REFRESH_SECONDS:
+                full = True
+            stack = [('', False, False)]
+            visited = set()
+            while stack:
+                rel_dir, hidden, sealed = stack.pop()
+                sealed = sealed or is_sealed(rel_dir, now)
+                visited.add(rel_dir)
+                path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+                node = self._nodes.get(rel_dir)
+                try:
+                    dir_mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if node is None:
+                    node = self._nodes[rel_dir] = _DirNode(hidden)
+
+                if full or node.mtime_ns != dir_mtime:
+                    node.files, node.subdirs = {}, set()
+                    try:
+                        with os.scandir(path) as entries:
+                            for entry in entries:
+                                try:
+                                    if entry.is_dir(follow_symlinks=False):
+                                        if entry.name.startswith('.') and not self.include_hidden:
+                                            continue
+                                        node.subdirs.add(entry.name)
+                                    elif entry.is_file(follow_symlinks=False):
+                                        if entry.name.endswith(PARTIAL_SUFFIX):
+                                            continue
+                                        st = entry.stat(follow_symlinks=False)
+                                        node.files[entry.name] = (st.st_size, st.st_mtime_ns, st.st_dev,
+                                                                  st.st_ino, st.st_nlink)
+                                        stated += 1
+                                except FileNotFoundError:
+                                    continue
+                    except FileNotFoundError:
+                        continue
+                    listed += 1
+                    # Changes landing in the same timestamp tick would be missed; list again next time
+                    node.mtime_ns = dir_mtime if now_ns - dir_mtime > MTIME_SETTLE_NS else None
+                elif not sealed:
+                    for name, info in list(node.files.items()):
+                        if info[1] < hot_cutoff:
+                            continue
+                        try:
+                            st = os.stat(os.path.join(path, name))
+                            node.files[name] = (st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino, st.st_nlink)
+                            stated += 1
+                        except FileNotFoundError:
+                            del node.files[name]
+
+                for name in node.subdirs:
+                    stack.append((os.path.join(rel_dir, name) if rel_dir else name,
+                                  hidden or name.startswith('.'), sealed))
+
+            for rel_dir in [d for d in self._nodes if d not in visited]:
+                del self._nodes[rel_dir]
+            self.refreshed_at = time.time()
+            if full:
+                self.full_refreshed_at = self.refreshed_at
+        system_logger.debug(f"FS CATALOG: Refreshed {self.root}, listed {listed} directories, stat'ed {stated} files")
+        return listed, stated
+
+    def _prefix(self, under):
+        if under is None:
+            return ''
+        rel = os.path.relpath(os.path.abspath(under), self.abs_root)
+        return '' if rel == '.' else rel
+
+    def files(self, under=None, hidden=False):
+        """Iterate FileEntry for every file under a path (default: the whole root)
+
+        :param hidden: also yield files inside dot-directories
+        """
+        prefix = self._prefix(under)
+        # Snapshot under the lock, yield without it: a caller that stops early
+        # (or closes the generator from another thread) must not keep it held
+        with self._lock:
+            snapshot = [
+                (os.path.join(self.root, rel_dir) if rel_dir else self.root, list(node.files.items()))
+                for rel_dir, node in self._nodes.items()
+                if (not prefix or rel_dir == prefix or rel_dir.startswith(prefix + os.sep))
+                and (hidden or not node.hidden)
+            ]
+        for base, files in snapshot:
+            for name, (size, mtime_ns, dev, inode, nlink) in files:
+                yield FileEntry(os.path.join(base, name), size, mtime_ns, dev, inode, nlink)
+
+    def changed_since(self, timestamp, under=None):
+        """Files modified after a unix timestamp"""
+        cutoff = int(timestamp * 1000 ** 3)
+        return [entry for entry in self.files(under) if entry.mtime_ns > cutoff]
+
+    def older_than(self, timestamp, under=None):
+        """Files last modified before a unix timestamp"""
+        cutoff = int(timestamp * 1000 ** 3)
+        return [entry for entry in self.files(under) if entry.mtime_ns < cutoff]
+
+    def count(self, under=None, hidden=False):
+        return sum(1 for _ in self.files(under, hidden))
+
+    def total_size(self, under=None, hidden=False):
+        """Bytes used under a path; hardlinked files are counted once"""
+        total = 0
+        seen_inodes = set()
+        for entry in self.files(under, hidden):
+            if entry.nlink > 1:
+                if (entry.dev, entry.inode) in seen_inodes:
+                    continue
+                seen_inodes.add((entry.dev, entry.inode))
+            total += entry.size
+        return total
+
+    def discard(self, path):
+        """Drop a file the caller just deleted, without waiting for the next refresh"""
+        rel = os.path.relpath(os.path.abspath(path), self.abs_root)
+        with self._lock:
+            node = self._nodes.get(os.path.dirname(rel))
+            if node is not None:
+                node.files.pop(os.path.basename(rel), None)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def catalog_for(path, include_hidden=False):
+    """Return the process-wide catalog covering path, creating one if needed
+
+    An existing catalog rooted at an ancestor of path is reused; query it
+    with under=path.
+    """
+    abs_path = os.path.abspath(path)
+    with _catalogs_lock:
+        for root, catalog in _catalogs.items():
+            covers = abs_path == root or abs_path.startswith(root.rstrip(os.sep) + os.sep)
+            if covers and (catalog.include_hidden or not include_hidden):
+                return catalog
+        catalog = _catalogs[abs_path] = FsCatalog(path, include_hidden=include_hidden)
+        return catalog
@@ -1,16 +1,47 @@
 import os
+import time
+import random
 import subprocess
-import json
 import hashlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
 from logger_config import system_logger, log_error_with_context, log_function_entry, log_function_exit
+from fs_catalog import catalog_for
+from partitions import is_sealed
+from media_store import hash_file
+from push_tracker import PushTracker
 
 # Load environment variables from .env file
 load_dotenv()
 
-# File to track pushed files state
-PUSHED_FILES_TRACKER = 'logs/pushed_files_tracker.json'
+# Pushed files state (SQLite under data/, see push_tracker)
+_tracker = None
+
+# Change detection hashing: any hashlib algorithm, spread over a thread pool
+HASH_ALGORITHM = os.getenv('GIT_HASH_ALGORITHM', 'blake2b')
+HASH_WORKERS = int(os.getenv('GIT_HASH_WORKERS', '4'))
+
+if HASH_ALGORITHM not in hashlib.algorithms_available:
+    system_logger.error(f"Unknown GIT_HASH_ALGORITHM {HASH_ALGORITHM}, using blake2b")
+    HASH_ALGORITHM = 'blake2b'
+
+# "cli" (git plumbing, one process per step) or "dulwich" (in-process, if installed)
+GIT_BACKEND = os.getenv('GIT_BACKEND', 'cli').lower()
+
+# Changes are committed in batches of at most this many bytes / files, pushed one by one
+PUSH_BATCH_MAX_BYTES = int(float(os.getenv('GIT_BATCH_MAX_MB', '50')) * 1024 * 1024)
+PUSH_BATCH_MAX_FILES = int(os.getenv('GIT_BATCH_MAX_FILES', '500'))
+
+# Each push attempt is killed after PUSH_TIMEOUT seconds and retried with exponential backoff
+PUSH_TIMEOUT = int(os.getenv('GIT_PUSH_TIMEOUT', '600'))
+PUSH_ATTEMPTS = int(os.getenv('GIT_PUSH_ATTEMPTS', '4'))
+PUSH_BACKOFF_BASE = 30
+PUSH_BACKOFF_MAX = 10 * 60
+
+# Tracker meta key holding the last commit the remote acknowledged, per branch
+ACKED_COMMIT_KEY = 'acked_commit:{branch}'
 
 def get_ist_time():
     """Get the current time in IST and format it."""
@@ -24,74 +55,299 @@ def get_ist_time():
     # Format the time as a string for the commit message
     return ist_time.strftime("%Y-%m-%d %H:%M:%S %Z")
 
-def get_file_hash(file_path):
-    """Calculate MD5 hash of a file for change detection"""
-    try:
-        with open(file_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
-    except Exception as e:
-        system_logger.error(f"Error calculating hash for {file_path}: {str(e)}")
-        return None
+class GitBackend(ABC):
+    """Git operations used by incremental_push_to_github; paths are relative to the repo."""
+    
+    name = 'base'
+    
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+    
+    @abstractmethod
+    def stage(self, paths):
+        """Stage all paths in one operation; returns (ok, error)"""
+    
+    @abstractmethod
+    def staged_paths(self):
+        """Paths that differ between the index and HEAD"""
+    
+    @abstractmethod
+    def commit(self, message):
+        """Commit the index; returns (ok, error)"""
+    
+    def head(self):
+        """Commit id of HEAD, or None before the first commit"""
+        result = subprocess.run(
+            ['git', 'rev-parse', '--verify', '--quiet', 'HEAD'],
+            capture_output=True, text=True, cwd=self.repo_path
+        )
+        return result.stdout.strip() if result.returncode == 0 else None
+    
+    def commits_after(self, base):
+        """Commits on HEAD that are not in base, oldest first
+        
+        An unknown base (first run, rewritten history) yields just HEAD.
+        """
+        head = self.head()
+        if head is None or head == base:
+            return []
+        if base:
+            result = subprocess.run(
+                ['git', 'rev-list', '--reverse', f'{base}..HEAD'],
+                capture_output=True, text=True, cwd=self.repo_path
+            )
+            if result.returncode == 0:
+                return result.stdout.split()
+        return [head]
+    
+    def push(self, repo_url, branch, commit='HEAD', timeout=None):
+        """Force push a commit to the branch (one-way); returns (ok, error)"""
+        try:
+            result = subprocess.run(
+                ['git', 'push', '--force', repo_url, f'{commit}:refs/heads/{branch}'],
+                capture_output=True, text=True, cwd=self.repo_path, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            return False, f"timed out after {timeout}s"
+        return result.returncode == 0, result.stderr
+
+class CliGitBackend(GitBackend):
+    """git CLI; all paths are staged by a single `git add` fed on stdin."""
+    
+    name = 'cli'
+    
+    def _git(self, *args, stdin=None):
+        return subprocess.run(
+            ['git', *args], input=stdin, capture_output=True, cwd=self.repo_path,
+            # Snap file names are paths, never globs
+            env={**os.environ, 'GIT_LITERAL_PATHSPECS': '1'}
+        )
+    
+    def stage(self, paths):
+        result = self._git('add', '--pathspec-from-file=-', '--pathspec-file-nul',
+                           stdin=b'\0'.join(os.fsencode(path) for path in paths))
+        return result.returncode == 0, result.stderr.decode('utf-8', 'replace')
+    
+    def staged_paths(self):
+        result = self._git('diff', '--cached', '--name-only', '-z')
+        return [os.fsdecode(path) for path in result.stdout.split(b'\0') if path]
+    
+    def commit(self, message):
+        result = self._git('commit', '-m', message)
+        return result.returncode == 0, result.stderr.decode('utf-8', 'replace')
 
-def load_pushed_files_tracker():
-    """Load the tracker of previously pushed files"""
-    log_function_entry(system_logger, "load_pushed_files_tracker")
-    if os.path.exists(PUSHED_FILES_TRACKER):
+class DulwichGitBackend(GitBackend):
+    """Pure-Python backend: blobs, index, trees and the commit are written in-process."""
+    
+    name = 'dulwich'
+    
+    def __init__(self, repo_path):
+        super().__init__(repo_path)
+        from dulwich.repo import Repo
+        self.repo = Repo(repo_path)
+    
+    def stage(self, paths):
+        try:
+            # Newer dulwich moved staging onto the worktree object
+            target = self.repo.get_worktree() if hasattr(self.repo, 'get_worktree') else self.repo
+            target.stage([os.fsencode(path) for path in paths])
+            return True, ''
+        except Exception as e:
+            return False, str(e)
+    
+    def staged_paths(self):
+        index = self.repo.open_index()
+        try:
+            head_tree = self.repo[self.repo.head()].tree
+        except KeyError:
+            # No commits yet: everything in the index is new
+            return [os.fsdecode(path) for path in index]
+        return [
+            os.fsdecode(new_path or old_path)
+            for (old_path, new_path), _, _ in index.changes_from_tree(self.repo.object_store, head_tree)
+        ]
+    
+    def commit(self, message):
+        from dulwich import porcelain
         try:
-            with open(PUSHED_FILES_TRACKER, 'r') as f:
-                data = json.load(f)
-            system_logger.debug(f"Loaded tracker with {len(data)} files")
-            return data
+            porcelain.commit(self.repo, message=message.encode('utf-8'))
+            return True, ''
         except Exception as e:
-            log_error_with_context(system_logger, e, "Loading pushed files tracker")
-    system_logger.debug("No existing tracker found, starting fresh")
-    return {}
+            return False, str(e)
 
-def save_pushed_files_tracker(tracker_data):
-    """Save the tracker of pushed files"""
-    log_function_entry(system_logger, "save_pushed_files_tracker", count=len(tracker_data))
+def get_git_backend(repo_path):
+    """Backend selected by GIT_BACKEND, falling back to the CLI"""
+    if GIT_BACKEND == 'dulwich':
+        try:
+            return DulwichGitBackend(repo_path)
+        except ImportError:
+            system_logger.warning("GIT BACKEND: dulwich is not installed, using git CLI")
+    return CliGitBackend(repo_path)
+
+def get_file_hash(file_path, algorithm=HASH_ALGORITHM):
+    """Hash a file for change detection, reading it in fixed-size chunks"""
     try:
-        os.makedirs(os.path.dirname(PUSHED_FILES_TRACKER), exist_ok=True)
-        with open(PUSHED_FILES_TRACKER, 'w') as f:
-            json.dump(tracker_data, f, indent=2)
-        system_logger.info(f"Updated pushed files tracker with {len(tracker_data)} files")
+        return hash_file(file_path, algorithm=algorithm)
     except Exception as e:
-        log_error_with_context(system_logger, e, "Saving pushed files tracker")
+        system_logger.error(f"Error calculating hash for {file_path}: {str(e)}")
+        return None
+
+def get_push_tracker():
+    """Open the pushed files tracker once per process (migrates the old JSON file)"""
+    global _tracker
+    if _tracker is None:
+        _tracker = PushTracker()
+        system_logger.debug(f"Loaded tracker with {len(_tracker)} files")
+    return _tracker
 
 def get_incremental_changes(folder_path):
-    """Identify only new/modified files since last push"""
-    tracker = load_pushed_files_tracker()
-    current_files = {}
+    """Identify only new/modified files since last push
+    
+    Files whose (size, mtime_ns, inode) match the tracker are trusted as
+    unchanged; only the rest are hashed, in parallel. Tracked files are
+    hashed with the algorithm their record was made with (e.g. MD5 rows
+    migrated from the old JSON tracker), so switching algorithms alone
+    never marks a file as modified; once a file really changes, its new
+    record is made with HASH_ALGORITHM.
+    
+    :return: (changed paths, tracker records to save once they are pushed,
+              tracked paths no longer on disk)
+    """
+    tracker = get_push_tracker()
+    pending_records = {}
+    refreshed = {}
     new_or_modified = []
+    suspects = []
+    upgrades = []
+    present = set()
     
-    # Scan all files in the directory
-    for root, dirs, files in os.walk(folder_path):
-        # Skip .git directory
-        dirs[:] = [d for d in dirs if d != '.git']
+    # Scan all files in the directory (.git and in-progress downloads are not indexed)
+    catalog = catalog_for(folder_path)
+    catalog.refresh()
+    for entry in catalog.files(under=folder_path):
+        relative_path = os.path.relpath(entry.path, folder_path)
+        present.add(relative_path)
+        pushed = tracker.get(relative_path)
         
-        for file in files:
-            file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(file_path, folder_path)
-            
-            # Calculate current hash
-            current_hash = get_file_hash(file_path)
-            if current_hash:
-                current_files[relative_path] = {
+        if pushed is not None:
+            unchanged = (pushed.get('size') == entry.size and pushed.get('mtime_ns') == entry.mtime_ns
+                         and pushed.get('inode') == entry.inode)
+            # Sealed date partitions cannot change any more: reuse what was pushed
+            if unchanged or is_sealed(os.path.dirname(entry.path)):
+                continue
+        suspects.append((relative_path, entry, pushed))
+    
+    def algorithm_for(pushed):
+        algorithm = (pushed or {}).get('algorithm') or HASH_ALGORITHM
+        return algorithm if algorithm in hashlib.algorithms_available else HASH_ALGORITHM
+    
+    if suspects:
+        system_logger.debug(f"Hashing {len(suspects)} new or changed files")
+        with ThreadPoolExecutor(max_workers=max(1, HASH_WORKERS)) as pool:
+            hashes = pool.map(lambda item: get_file_hash(item[1].path, algorithm_for(item[2])), suspects)
+            for (relative_path, entry, pushed), current_hash in zip(suspects, hashes):
+                if not current_hash:
+                    continue
+                record = {
                     'hash': current_hash,
-                    'mtime': os.path.getmtime(file_path)
+                    'algorithm': algorithm_for(pushed),
+                    'size': entry.size,
+                    'mtime': entry.mtime_ns / 1e9,
+                    'mtime_ns': entry.mtime_ns,
+                    'inode': entry.inode
                 }
                 
-                # Check if file is new or modified
-                if (relative_path not in tracker or 
-                    tracker[relative_path].get('hash') != current_hash):
+                # Check if file is new or modified (a row in an unavailable algorithm never matches)
+                if pushed is None or pushed.get('hash') != current_hash:
                     new_or_modified.append(relative_path)
+                    pending_records[relative_path] = record
+                    if record['algorithm'] != HASH_ALGORITHM:
+                        upgrades.append((relative_path, entry))
+                else:
+                    # Same content (relinked into the media store, migrated row without stat):
+                    # just remember the new stat
+                    refreshed[relative_path] = record
     
-    return new_or_modified, current_files
+            # Changed files recorded with an older algorithm move to HASH_ALGORITHM
+            for (relative_path, entry), current_hash in zip(
+                    upgrades, pool.map(lambda item: get_file_hash(item[1].path), upgrades)):
+                if current_hash:
+                    pending_records[relative_path].update(hash=current_hash, algorithm=HASH_ALGORITHM)
+    
+    if refreshed:
+        tracker.record(refreshed)
+    
+    # Rows for files removed by retention; dropped together with the next successful push
+    gone = tracker.paths() - present
+    return new_or_modified, pending_records, gone
+
+def plan_push_batches(paths, records, max_bytes=PUSH_BATCH_MAX_BYTES, max_files=PUSH_BATCH_MAX_FILES):
+    """Split changed paths into commit-sized batches, oldest files first
+    
+    A file larger than max_bytes gets a batch of its own.
+    
+    :param records: pending tracker records, for sizes and mtimes
+    :return: list of path lists
+    """
+    ordered = sorted(paths, key=lambda path: (records[path].get('mtime_ns') or 0, path))
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for path in ordered:
+        size = records[path].get('size') or 0
+        if batch and (batch_bytes + size > max_bytes or len(batch) >= max_files):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(path)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def push_with_retry(backend, repo_url, branch, commit):
+    """Push one commit with a timeout per attempt and exponential backoff between attempts"""
+    for attempt in range(1, PUSH_ATTEMPTS + 1):
+        started = time.monotonic()
+        pushed, push_error = backend.push(repo_url, branch, commit=commit, timeout=PUSH_TIMEOUT)
+        if pushed:
+            system_logger.info(f"GIT PUSH: {commit[:10]} acknowledged in {time.monotonic() - started:.1f}s")
+            return True
+        if attempt == PUSH_ATTEMPTS:
+            break
+        delay = min(PUSH_BACKOFF_MAX, PUSH_BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+        system_logger.warning(
+            f"GIT PUSH: Attempt {attempt}/{PUSH_ATTEMPTS} for {commit[:10]} failed ({push_error.strip()}), "
+            f"retrying in {delay:.0f}s"
+        )
+        time.sleep(delay)
+    system_logger.error(f"GIT PUSH FAILED: {commit[:10]} after {PUSH_ATTEMPTS} attempts: {push_error}")
+    return False
+
+def push_pending_commits(backend, repo_url, branch):
+    """Push local commits the remote has not acknowledged yet, one at a time, in order
+    
+    :return: True once the remote is caught up with HEAD
+    """
+    tracker = get_push_tracker()
+    key = ACKED_COMMIT_KEY.format(branch=branch)
+    pending = backend.commits_after(tracker.get_meta(key))
+    if not pending:
+        return True
+    system_logger.info(f"GIT PUSH: Resuming {len(pending)} unpushed commits")
+    for commit in pending:
+        if not push_with_retry(backend, repo_url, branch, commit):
+            return False
+        tracker.set_meta(key, commit)
+    return True
 
 def incremental_push_to_github(folder_path, branch='main'):
     """
     Push only new/modified files to GitHub incrementally (optimized for storage).
     
+    Changes are committed in size-bounded batches and each commit is pushed
+    on its own. A failed push leaves its commit (and any later ones) local;
+    the next call pushes those first, starting after the last acknowledged one.
+    
     :param folder_path: Path to the folder containing the Git repository.
     :param branch: The branch to push to. Default is 'main'.
     """
@@ -100,11 +356,27 @@ def incremental_push_to_github(folder_path, branch='main'):
     try:
         system_logger.info(f"GIT PUSH: Starting incremental push for {folder_path}")
         
+        # Get repository URL
+        repo_url = os.getenv('REPO_URL_WITH_TOKEN')
+        if not repo_url:
+            system_logger.error("GIT PUSH FAILED: No REPO_URL_WITH_TOKEN in environment")
+            return False
+        
+        backend = get_git_backend(folder_path)
+        tracker = get_push_tracker()
+        acked_key = ACKED_COMMIT_KEY.format(branch=branch)
+        
+        # Commits left behind by a failed or interrupted push go out first
+        if not push_pending_commits(backend, repo_url, branch):
+            return False
+        
         # Get incremental changes
         system_logger.debug("Analyzing file changes...")
-        new_or_modified, current_files = get_incremental_changes(folder_path)
+        new_or_modified, pending_records, gone = get_incremental_changes(folder_path)
         
         if not new_or_modified:
+            if gone:
+                tracker.record({}, forget=gone)
             system_logger.info("GIT PUSH: No changes detected, repository up to date")
             return True
         
@@ -114,69 +386,58 @@ def incremental_push_to_github(folder_path, branch='main'):
         if len(new_or_modified) > 10:
             system_logger.info(f"  ... and {len(new_or_modified) - 10} more files")
         
-        # Add files to git
-        added_files = 0
-        for file_path in new_or_modified:
-            system_logger.debug(f"Adding to git: {file_path}")
-            add_result = subprocess.run(
-                ['git', 'add', file_path], 
-                capture_output=True, text=True, cwd=folder_path
-            )
-            if add_result.returncode != 0:
-                system_logger.error(f"Failed to add {file_path}: {add_result.stderr}")
-                continue
-            added_files += 1
-        
-        system_logger.info(f"GIT ADD: Successfully added {added_files}/{len(new_or_modified)} files")
-
-        # Verify staged changes
-        status_result = subprocess.run(
-            ['git', 'diff', '--cached', '--name-only'], 
-            capture_output=True, text=True, cwd=folder_path
+        batches = plan_push_batches(new_or_modified, pending_records)
+        total_bytes = sum(record.get('size') or 0 for record in pending_records.values())
+        system_logger.info(
+            f"GIT PUSH: {total_bytes / (1024*1024):.2f} MB in {len(batches)} commits "
+            f"(max {PUSH_BATCH_MAX_BYTES / (1024*1024):.0f} MB / {PUSH_BATCH_MAX_FILES} files each), "
+            f"force pushing to {branch} (one-way, no pull)"
         )
         
-        staged_files = status_result.stdout.strip().split('\n') if status_result.stdout.strip() else []
-        system_logger.info(f"GIT STATUS: {len(staged_files)} files staged for commit")
-        
-        if not staged_files or not staged_files[0]:
-            system_logger.warning("GIT STATUS: No staged changes found after adding files")
-            return False
-
-        # Create commit
-        commit_message = f"Incremental update: {len(staged_files)} files at {get_ist_time()}"
-        system_logger.info(f"GIT COMMIT: Creating commit with message: {commit_message}")
-        
-        commit_result = subprocess.run(
-            ['git', 'commit', '-m', commit_message], 
-            capture_output=True, text=True, cwd=folder_path
-        )
-        if commit_result.returncode != 0:
-            system_logger.error(f"GIT COMMIT FAILED: {commit_result.stderr}")
-            return False
-        
-        system_logger.info("GIT COMMIT: Successfully created commit")
-
-        # Get repository URL
-        repo_url = os.getenv('REPO_URL_WITH_TOKEN')
-        if not repo_url:
-            system_logger.error("GIT PUSH FAILED: No REPO_URL_WITH_TOKEN in environment")
-            return False
-
-        # Force push (one-way)
-        system_logger.info(f"GIT PUSH: Force pushing to {branch} (one-way, no pull)")
-        push_result = subprocess.run(
-            ['git', 'push', '--force', repo_url, branch], 
-            capture_output=True, text=True, cwd=folder_path
-        )
+        for index, batch in enumerate(batches, 1):
+            part = f" (part {index}/{len(batches)})" if len(batches) > 1 else ""
             
-        if push_result.returncode == 0:
-            system_logger.info(f"GIT PUSH SUCCESS: Pushed {len(staged_files)} files to {branch}")
-            # Update tracker only after successful push
-            save_pushed_files_tracker(current_files)
-            return True
-        else:
-            system_logger.error(f"GIT PUSH FAILED: {push_result.stderr}")
-            return False
+            # Add files to git, all in one operation
+            added, add_error = backend.stage(batch)
+            if added:
+                system_logger.info(f"GIT ADD: Staged {len(batch)} files{part} ({backend.name} backend)")
+            else:
+                # Paths that could be staged still are; the status check below decides
+                system_logger.error(f"GIT ADD: Staging reported errors: {add_error}")
+            
+            # Verify staged changes
+            staged_files = backend.staged_paths()
+            system_logger.info(f"GIT STATUS: {len(staged_files)} files staged for commit")
+            
+            if staged_files:
+                # Create commit
+                commit_message = f"Incremental update: {len(staged_files)} files at {get_ist_time()}{part}"
+                system_logger.info(f"GIT COMMIT: Creating commit with message: {commit_message}")
+                
+                committed, commit_error = backend.commit(commit_message)
+                if not committed:
+                    system_logger.error(f"GIT COMMIT FAILED: {commit_error}")
+                    return False
+                
+                commit = backend.head()
+                if not push_with_retry(backend, repo_url, branch, commit):
+                    system_logger.error(f"GIT PUSH FAILED: Stopped at commit {index}/{len(batches)}, "
+                                        f"the rest is pushed next time")
+                    return False
+                tracker.set_meta(acked_key, commit)
+                system_logger.info(f"GIT PUSH SUCCESS: Pushed {len(staged_files)} files to {branch}{part}")
+            elif not added:
+                system_logger.warning("GIT STATUS: No staged changes found after adding files")
+                return False
+            else:
+                # Content is already in an acknowledged commit (e.g. from an interrupted run)
+                system_logger.info(f"GIT STATUS: Nothing new to commit{part}, already pushed")
+            
+            # Update tracker once this batch is on the remote, in one transaction
+            tracker.record({path: pending_records[path] for path in batch},
+                           forget=gone if index == len(batches) else ())
+        
+        return True
 
     except subprocess.CalledProcessError as e:
         log_error_with_context(system_logger, e, f"Git subprocess error in {folder_path}")
@@ -186,8 +447,8 @@ def incremental_push_to_github(folder_path, branch='main'):
         return False
 
 def push_to_github(folder_path, branch='main'):
-    """Wrapper function that calls incremental push"""
-    incremental_push_to_github(folder_path, branch)
+    """Wrapper function that calls incremental push; returns True on success"""
+    return incremental_push_to_github(folder_path, branch)
 
 if __name__ == "__main__":
     # These are for testing purposes only.
@@ -6,6 +6,7 @@ import random
 import string
 import logging
 from logging.handlers import RotatingFileHandler
+from fs_catalog import catalog_for
 
 # Setup improved logging for helper module
 logger = logging.getLogger('helper')
@@ -46,7 +47,10 @@ def zip_directory(directory):
     
     try:
         # Calculate total files to zip
-        total_files = sum(len(files) for _, _, files in os.walk(directory))
+        catalog = catalog_for(directory, include_hidden=True)
+        catalog.refresh()
+        entries = list(catalog.files(under=directory, hidden=True))
+        total_files = len(entries)
         logger.info(f"Preparing to zip {total_files} files from {directory}")
         
         # Create a zip file of the entire directory with AES encryption
@@ -56,31 +60,29 @@ def zip_directory(directory):
             files_processed = 0
             total_size = 0
             
-            for root, dirs, files in os.walk(directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, directory)
+            for entry in entries:
+                file_path = entry.path
+                arcname = os.path.relpath(file_path, directory)
+                
+                try:
+                    # Size comes from the catalog, no extra stat
+                    total_size += entry.size
                     
-                    try:
-                        # Get file size for logging
-                        file_size = os.path.getsize(file_path)
-                        total_size += file_size
-                        
-                        # Read the file content
-                        with open(file_path, 'rb') as f:
-                            file_content = f.read()
-                        
-                        # Write the file content to the zip file with AES encryption
-                        zipf.writestr(arcname, file_content)
-                        files_processed += 1
+                    # Read the file content
+                    with open(file_path, 'rb') as f:
+                        file_content = f.read()
+                    
+                    # Write the file content to the zip file with AES encryption
+                    zipf.writestr(arcname, file_content)
+                    files_processed += 1
+                    
+                    # Log progress every 10 files
+                    if files_processed % 10 == 0:
+                        logger.info(f"Zipped {files_processed}/{total_files} files")
                         
-                        # Log progress every 10 files
-                        if files_processed % 10 == 0:
-                            logger.info(f"Zipped {files_processed}/{total_files} files")
-                            
-                    except Exception as e:
-                        logger.error(f"Error processing file {file_path}: {str(e)}")
-                        continue
+                except Exception as e:
+                    logger.error(f"Error processing file {file_path}: {str(e)}")
+                    continue
         
         # Log final statistics
         zip_size = os.path.getsize(zip_filename) if os.path.exists(zip_filename) else 0
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Content-addressed media store for snap-tracker
+Every downloaded file is hashed while streaming and kept once under
+<MEDIA_STORE_DIR>/<hh>/<hash>; the user/date paths in DOWNLOAD_DIR are
+hardlinks into the store, so reposted media costs its bytes only once
+"""
+
+import os
+import errno
+import hashlib
+from dotenv import load_dotenv
+from logger_config import system_logger, log_error_with_context
+
+# Load environment variables
+load_dotenv()
+
+# Must be on the same filesystem as DOWNLOAD_DIR for hardlinks to work
+MEDIA_STORE_DIR = os.getenv('MEDIA_STORE_DIR', 'media_store')
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE, algorithm='sha256'):
+    """Hex digest of a file, read in fixed-size chunks (blob names use SHA-256)"""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    """Blob directory keyed by content hash, shared through hardlinks."""
+
+    def __init__(self, root=MEDIA_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def ingest(self, path):
+        """Move a finished file into the store and leave a hardlink at its path
+
+        :return: (digest, deduplicated) or (None, False) if the file was left alone
+        """
+        try:
+            digest = hash_file(path)
+            blob = self.blob_path(digest)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+
+            try:
+                os.link(path, blob)
+                return digest, False
+            except FileExistsError:
+                pass
+
+            if os.path.samefile(path, blob):
+                return digest, False
+
+            # Same bytes already stored: swap the file for a link to the blob
+            # (the .part suffix keeps the monitor and git scans off the temp link)
+            tmp_path = path + '.dedup.part'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            os.link(blob, tmp_path)
+            os.replace(tmp_path, path)
+            system_logger.debug(f"MEDIA STORE: Deduplicated {path} -> {digest[:12]}")
+            return digest, True
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                system_logger.warning(f"MEDIA STORE: {self.root} is on another filesystem, keeping {path} as is")
+            else:
+                log_error_with_context(system_logger, e, f"Ingesting {path} into media store")
+            return None, False
+
+    def gc(self):
+        """Delete blobs no longer linked from any user/date path
+
+        :return: (blobs removed, bytes freed)
+        """
+        removed = 0
+        freed = 0
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_nlink <= 1:
+                        os.remove(entry.path)
+                        removed += 1
+                        freed += stat.st_size
+                except OSError as e:
+                    system_logger.error(f"MEDIA STORE: Could not collect {entry.path}: {e}")
+        system_logger.info(f"MEDIA STORE GC: Removed {removed} unreferenced blobs, freed {freed / (1024*1024):.2f} MB")
+        return removed, freed
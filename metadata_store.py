@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Consolidated snap metadata store for snap-tracker
+Appends one JSON line per snap to <DOWNLOAD_DIR>/<username>/<YYYY-MM-DD>/snaps.jsonl
+instead of writing a .json file next to every downloaded video/picture
+"""
+
+import os
+import json
+import threading
+from logger_config import snapchat_logger, log_error_with_context
+
+SEGMENT_NAME = 'snaps.jsonl'
+
+# snapId sets kept in memory; only today's and yesterday's segments are written to
+MAX_CACHED_SEGMENTS = 256
+
+
+class MetadataStore:
+    """Per-user, per-day JSON lines segments with a small query API."""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        # snapIds already written, per segment path, loaded on first use (least recently used first)
+        self._segments = {}
+
+    def segment_path(self, username, date_str):
+        return os.path.join(self.root, username, date_str, SEGMENT_NAME)
+
+    def _known_ids(self, path):
+        known = self._segments.pop(path, None)
+        if known is None:
+            known = {record.get('snapId') for record in self._read(path)}
+        self._segments[path] = known
+        while len(self._segments) > MAX_CACHED_SEGMENTS:
+            del self._segments[next(iter(self._segments))]
+        return known
+
+    @staticmethod
+    def _read(path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash; skip it
+                    continue
+
+    def append(self, username, date_str, media, snap_user=None, filename=None):
+        """Record one snap's metadata; repeated snapIds are ignored
+
+        :param media: the snap entry from the profile's snapList
+        :param snap_user: the profile's user info
+        :param filename: name of the media file the snap was saved as
+        """
+        record = {
+            'snapId': media['snapId']['value'],
+            'timestamp': int(media['timestampInSec']['value']),
+            'mediaType': media.get('snapMediaType'),
+            'file': filename,
+            'snapUser': snap_user,
+        }
+        path = self.segment_path(username, date_str)
+        with self._lock:
+            try:
+                known = self._known_ids(path)
+                if record['snapId'] in known:
+                    return False
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'a') as f:
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                known.add(record['snapId'])
+                return True
+            except Exception as e:
+                log_error_with_context(snapchat_logger, e, f"Appending metadata for {username}/{date_str}")
+                return False
+
+    def dates(self, username):
+        """Days that have a metadata segment for this user, oldest first"""
+        user_dir = os.path.join(self.root, username)
+        if not os.path.isdir(user_dir):
+            return []
+        return sorted(
+            entry.name for entry in os.scandir(user_dir)
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, SEGMENT_NAME))
+        )
+
+    def snaps(self, username, date_str=None):
+        """Iterate the metadata records of one user, optionally for a single day"""
+        for day in ([date_str] if date_str else self.dates(username)):
+            yield from self._read(self.segment_path(username, day))
+
+    def find(self, snap_id, username=None):
+        """Return the record of a snapId, searching one user or all users"""
+        if username is not None:
+            users = [username]
+        elif os.path.isdir(self.root):
+            users = [e.name for e in os.scandir(self.root) if e.is_dir() and not e.name.startswith('.')]
+        else:
+            users = []
+        for user in users:
+            for record in self.snaps(user):
+                if record.get('snapId') == snap_id:
+                    return record
+        return None
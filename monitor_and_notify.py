@@ -1,10 +1,16 @@
 import os
 import time
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from logger_config import system_logger, log_error_with_context, log_function_entry, log_function_exit
-from telegram_helper import send_telegram_message, send_telegram_file
+from telegram_helper import send_telegram_message, send_telegram_file, send_telegram_media, flush_outbox
 from git_commiter import push_to_github
+from download_watcher import DownloadWatcher
+from pipeline import Stage
+from metadata_store import MetadataStore, SEGMENT_NAME
+from fs_catalog import catalog_for
+from event_stream import subscribe, USER_FAILED, USER_FINISHED
 
 # Load environment variables
 load_dotenv()
@@ -12,6 +18,18 @@ load_dotenv()
 # Directory to monitor
 DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR')
 
+# Longest wait between cycles; inotify wakes the monitor as soon as files land
+SCAN_INTERVAL = 600
+
+# "album" also sends new photos/videos as Telegram albums; "off" sends the text summary only
+TELEGRAM_MEDIA_MODE = os.getenv('TELEGRAM_MEDIA_MODE', 'off').lower()
+
+# Batches waiting per pipeline stage before detection blocks
+PIPELINE_QUEUE_SIZE = int(os.getenv('MONITOR_PIPELINE_QUEUE', '32'))
+
+# Batches detected within this many seconds of each other go out in one push
+PUSH_COALESCE_SECONDS = float(os.getenv('GIT_PUSH_COALESCE_SECONDS', '60'))
+
 if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
     system_logger.info(f"Created missing directory: {DOWNLOAD_DIR}")
@@ -34,15 +52,10 @@ def log_download_summary():
     """Log summary of downloads directory for tracking"""
     log_function_entry(system_logger, "log_download_summary")
     try:
-        total_files = 0
-        total_size = 0
-        for root, dirs, files in os.walk(DOWNLOAD_DIR):
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            for file in files:
-                file_path = os.path.join(root, file)
-                if os.path.exists(file_path):
-                    total_files += 1
-                    total_size += os.path.getsize(file_path)
+        catalog = catalog_for(DOWNLOAD_DIR)
+        catalog.refresh()
+        total_files = catalog.count(under=DOWNLOAD_DIR)
+        total_size = catalog.total_size(under=DOWNLOAD_DIR)
         
         system_logger.info(f"Download directory summary: {total_files} files, {total_size / (1024*1024):.2f} MB total")
         log_function_exit(system_logger, "log_download_summary", f"{total_files} files, {total_size / (1024*1024):.2f} MB")
@@ -51,20 +64,176 @@ def log_download_summary():
         log_error_with_context(system_logger, e, "Calculating download summary")
         return 0, 0
 
+def downloaded_media(new_files):
+    """New files minus the per-day snaps.jsonl metadata segments"""
+    return [f for f in new_files if os.path.basename(f) != SEGMENT_NAME]
+
+def notify_new_files(new_files, reason="New Snapchat story downloaded"):
+    """Send the Telegram summary for new files (the push is reported separately)."""
+    new_files = downloaded_media(new_files)
+    if not new_files:
+        return True
+    system_logger.info(f"NEW FILES DETECTED: {len(new_files)} files")
+    for file in new_files:
+        system_logger.info(f"  -> {file}")
+    
+    # Calculate storage info
+    total_size = 0
+    try:
+        for f in new_files:
+            if os.path.exists(f):
+                size = os.path.getsize(f)
+                total_size += size
+                system_logger.debug(f"File size: {f} = {size} bytes")
+        system_logger.info(f"Total new files size: {total_size / (1024*1024):.2f} MB")
+    except Exception as e:
+        log_error_with_context(system_logger, e, "Calculating file sizes")
+        total_size = 0
+    
+    # Get timestamp
+    ist_time = get_ist_time()
+    file_names = [os.path.basename(f) for f in new_files]
+    
+    # Send Telegram notification
+    try:
+        system_logger.info("Preparing Telegram notification")
+        message = f"📥 {reason}\n\n"
+        message += f"📁 Files: {len(new_files)}\n"
+        message += f"📊 Size: {total_size / (1024*1024):.2f} MB\n"
+        message += f"🕒 Time: {ist_time}\n\n"
+        
+        if len(file_names) <= 5:
+            message += f"📋 Files:\n" + "\n".join([f"• {name}" for name in file_names])
+        else:
+            message += f"📋 Files (showing first 5):\n" + "\n".join([f"• {name}" for name in file_names[:5]])
+            message += f"\n... and {len(file_names) - 5} more files"
+        
+        system_logger.debug(f"Telegram message prepared: {len(message)} characters")
+        
+        system_logger.info("Sending Telegram notification")
+        sent = send_telegram_message(message, coalesce_key='new_files')
+        if sent:
+            system_logger.info(f"SUCCESS: Notification queued for {len(new_files)} files")
+        return sent
+        
+    except Exception as e:
+        log_error_with_context(system_logger, e, "Telegram notification process")
+        return False
+
+def media_captions(new_files):
+    """Captions for new media from the snap metadata: display name and posting time."""
+    metadata = MetadataStore(DOWNLOAD_DIR)
+    records = {}
+    captions = {}
+    for file_path in new_files:
+        parts = os.path.relpath(file_path, DOWNLOAD_DIR).split(os.sep)
+        if len(parts) != 3:
+            continue  # Not <username>/<date>/<file> (e.g. highlights)
+        username, date_str, file_name = parts
+        if (username, date_str) not in records:
+            records[(username, date_str)] = {r.get('file'): r for r in metadata.snaps(username, date_str)}
+        record = records[(username, date_str)].get(file_name)
+        if record is None:
+            captions[file_path] = f"{username} · {date_str}"
+            continue
+        display_name = (record.get('snapUser') or {}).get('title') or username
+        posted = datetime.fromtimestamp(record['timestamp'], timezone.utc).strftime("%d %B %Y %H:%M UTC")
+        captions[file_path] = f"{display_name} (@{username}) · {posted}"
+    return captions
+
+def send_new_media(new_files):
+    """Send new photos and videos as albums, one user at a time."""
+    new_files = downloaded_media(new_files)
+    by_user = {}
+    for file_path in new_files:
+        username = os.path.relpath(file_path, DOWNLOAD_DIR).split(os.sep)[0]
+        by_user.setdefault(username, []).append(file_path)
+    captions = media_captions(new_files)
+    for username, files in by_user.items():
+        sent, not_sent = send_telegram_media(files, captions)
+        system_logger.info(f"TELEGRAM MEDIA: {username}: {sent} sent, {not_sent} not sent")
+
+def alert_user_failures():
+    """Alert on Telegram when a user starts failing, and when it recovers.
+
+    Reads the downloader's event stream (see event_stream); transient failures
+    (throttling, network errors) are retried by the downloader and not reported.
+    """
+    failing = {}
+    for event in subscribe():
+        username = event.get('username')
+        if event.get('event') == USER_FAILED and not event.get('transient'):
+            if failing.get(username) == event.get('status'):
+                continue  # Already reported; the scheduler keeps retrying it
+            failing[username] = event.get('status')
+            message = f"⚠️ Snapchat download failing for {username}: {event.get('status')}"
+            if event.get('error'):
+                message += f"\n{event['error']}"
+            send_telegram_message(message, coalesce_key='user_failures')
+        elif event.get('event') == USER_FINISHED and failing.pop(username, None):
+            send_telegram_message(f"✅ Snapchat downloads recovered for {username}", coalesce_key='user_failures')
+
+def push_new_files(new_files):
+    """Push to GitHub and report the real outcome once it is known."""
+    system_logger.info(f"Starting GitHub push operation for {len(new_files)} new files")
+    started = time.monotonic()
+    push_result = push_to_github(DOWNLOAD_DIR, os.getenv('REPO_BRANCH'))
+    elapsed = time.monotonic() - started
+    
+    if push_result and not new_files:
+        system_logger.info(f"SUCCESS: Pending GitHub push resumed in {elapsed:.1f}s")
+        message = f"✅ Pending commits pushed to GitHub repository ({elapsed:.0f}s)"
+    elif push_result:
+        system_logger.info(f"SUCCESS: GitHub push finished in {elapsed:.1f}s")
+        message = f"✅ {len(new_files)} files pushed to GitHub repository ({elapsed:.0f}s)"
+    else:
+        system_logger.error(f"GitHub push failed after {elapsed:.1f}s")
+        message = f"❌ GitHub push failed for {len(new_files)} files, retrying with the next batch"
+    send_telegram_message(message, coalesce_key='push_status')
+    return push_result
+
 def monitor_downloads():
-    """Monitor the downloads directory for new files or folders at 10-minute intervals."""
+    """Watch the downloads directory; notify and push new files in independent stages."""
     log_function_entry(system_logger, "monitor_downloads", download_dir=DOWNLOAD_DIR)
     
     system_logger.info("Starting file monitoring system")
-    last_seen_files = set()
+    watcher = DownloadWatcher(DOWNLOAD_DIR)
     
-    # Initial scan
+    # Files come from inotify; the downloader's event stream is used for per-user failure alerts
+    threading.Thread(target=alert_user_failures, name='user-failure-alerts', daemon=True).start()
+    
+    def notify_stage(batch):
+        new_files, reason = batch
+        notify_new_files(new_files, reason)
+        watcher.mark_notified(new_files)
+    
+    push_failed = threading.Event()
+    
+    def push_stage(batches):
+        # Everything that queued up during the coalesce window or the previous push goes out in one push
+        if push_new_files([f for batch in batches for f in batch]):
+            push_failed.clear()
+        else:
+            push_failed.set()
+    
+    # detect (this thread) -> notify, and detect -> push; a slow push never delays a notification
+    notifier = Stage('notify', notify_stage, maxsize=PIPELINE_QUEUE_SIZE)
+    pusher = Stage('push', push_stage, maxsize=PIPELINE_QUEUE_SIZE, coalesce=True,
+                   linger=PUSH_COALESCE_SECONDS)
+    # Uploads are the slowest part, so albums get a stage of their own
+    media_sender = Stage('media', send_new_media, maxsize=PIPELINE_QUEUE_SIZE) if TELEGRAM_MEDIA_MODE == 'album' else None
+    
+    def dispatch(new_files, reason="New Snapchat story downloaded"):
+        notifier.put((new_files, reason))
+        pusher.put(new_files)
+        if media_sender is not None:
+            media_sender.put(new_files)
+    
+    # Initial scan: pick up whatever arrived while the monitor was down
     try:
-        for root, dirs, files in os.walk(DOWNLOAD_DIR):
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            for file in files:
-                last_seen_files.add(os.path.join(root, file))
-        system_logger.info(f"Initial scan complete: {len(last_seen_files)} files found")
+        missed_files = watcher.reconcile()
+        if missed_files:
+            dispatch(missed_files, reason="Snapchat stories downloaded while monitor was offline")
     except Exception as e:
         log_error_with_context(system_logger, e, "Initial directory scan")
     
@@ -74,78 +243,18 @@ def monitor_downloads():
             cycle_count += 1
             system_logger.debug(f"Starting monitoring cycle #{cycle_count}")
             
-            time.sleep(600)  # 10 minutes
-            current_files = set()
-            
-            # Scan for current files
-            try:
-                for root, dirs, files in os.walk(DOWNLOAD_DIR):
-                    dirs[:] = [d for d in dirs if not d.startswith('.')]
-                    for file in files:
-                        current_files.add(os.path.join(root, file))
-                system_logger.debug(f"Current scan: {len(current_files)} files found")
-            except Exception as e:
-                log_error_with_context(system_logger, e, "Directory scanning")
-                continue
-            
-            # Check for new files
-            new_files = current_files - last_seen_files
+            # Returns as soon as a batch of new files settles, or after SCAN_INTERVAL
+            new_files = watcher.wait_for_files(SCAN_INTERVAL)
             
             if new_files:
-                system_logger.info(f"NEW FILES DETECTED: {len(new_files)} files")
-                for file in new_files:
-                    system_logger.info(f"  -> {file}")
-                
-                # Calculate storage info
-                total_size = 0
-                try:
-                    for f in new_files:
-                        if os.path.exists(f):
-                            size = os.path.getsize(f)
-                            total_size += size
-                            system_logger.debug(f"File size: {f} = {size} bytes")
-                    system_logger.info(f"Total new files size: {total_size / (1024*1024):.2f} MB")
-                except Exception as e:
-                    log_error_with_context(system_logger, e, "Calculating file sizes")
-                    total_size = 0
-                
-                # Get timestamp
-                ist_time = get_ist_time()
-                file_names = [os.path.basename(f) for f in new_files]
-                
-                # Send Telegram notification
-                try:
-                    system_logger.info("Preparing Telegram notification")
-                    message = f"📥 New Snapchat story downloaded\n\n"
-                    message += f"📁 Files: {len(new_files)}\n"
-                    message += f"📊 Size: {total_size / (1024*1024):.2f} MB\n"
-                    message += f"🕒 Time: {ist_time}\n\n"
-                    
-                    if len(file_names) <= 5:
-                        message += f"📋 Files:\n" + "\n".join([f"• {name}" for name in file_names])
-                    else:
-                        message += f"📋 Files (showing first 5):\n" + "\n".join([f"• {name}" for name in file_names[:5]])
-                        message += f"\n... and {len(file_names) - 5} more files"
-                    
-                    system_logger.debug(f"Telegram message prepared: {len(message)} characters")
-                    
-                    # Push to GitHub first
-                    system_logger.info("Starting GitHub push operation")
-                    push_result = push_to_github(DOWNLOAD_DIR, os.getenv('REPO_BRANCH'))
-                    
-                    message += f"\n\n✅ Files pushed to GitHub repository"
-                    
-                    system_logger.info("Sending Telegram notification")
-                    send_telegram_message(message)
-                    system_logger.info(f"SUCCESS: Notification sent for {len(new_files)} files")
-                    
-                except Exception as e:
-                    log_error_with_context(system_logger, e, "Telegram notification process")
+                dispatch(new_files)
             else:
                 system_logger.debug(f"No new files detected in cycle #{cycle_count}")
+                if push_failed.is_set() and pusher.queue.empty():
+                    # Resume commits left unpushed without waiting for new downloads
+                    push_failed.clear()
+                    pusher.put([])
             
-            # Update file list
-            last_seen_files = current_files
             system_logger.debug(f"Cycle #{cycle_count} completed successfully")
             
         except Exception as e:
@@ -166,7 +275,7 @@ if __name__ == "__main__":
         try:
             startup_msg = "🚀 Snap-Tracker Monitoring Started\n\n"
             startup_msg += f"📂 Watching: {DOWNLOAD_DIR}\n"
-            startup_msg += f"⏱️ Check interval: 10 minutes\n"
+            startup_msg += f"⏱️ Check interval: instant (inotify), snapshot reconciled on start\n"
             startup_msg += f"🔄 Git push: Incremental, one-way\n"
             startup_msg += f"📊 Storage optimized: No zip files"
             
@@ -184,3 +293,6 @@ if __name__ == "__main__":
     except Exception as e:
         log_error_with_context(system_logger, e, "Main execution")
         system_logger.critical("SYSTEM FAILURE - Monitor stopped")
+    finally:
+        # Alerts queued just before stopping (e.g. the failure above) still go out
+        flush_outbox()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Date partitions of the download tree for snap-tracker
+The downloader writes to <DOWNLOAD_DIR>/<username>/<YYYY-MM-DD>/ with the
+date taken from the snap's UTC timestamp. Stories expire after 24 hours, so
+only today's and yesterday's partitions can still receive files; older ones
+are sealed and can be skipped by scans and dropped whole by retention
+"""
+
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from logger_config import system_logger, log_error_with_context
+
+# Matches snapchat_dl's strf_time(timestamp, "%Y-%m-%d") directory names
+PARTITION_FORMAT = '%Y-%m-%d'
+
+
+def parse_partition(name):
+    """Return the date of a partition directory name, or None if it is not one"""
+    if len(name) != 10:
+        return None
+    try:
+        return datetime.strptime(name, PARTITION_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def active_dates(now=None):
+    """UTC dates whose partitions can still change: today and yesterday"""
+    today = (now or datetime.now(timezone.utc)).astimezone(timezone.utc).date()
+    return {today, today - timedelta(days=1)}
+
+
+def is_sealed(path, now=None):
+    """True if path is a date partition that can no longer receive downloads"""
+    day = parse_partition(os.path.basename(os.path.normpath(path)))
+    return day is not None and day < min(active_dates(now))
+
+
+def iter_partitions(root):
+    """Yield (username, date, path) for every date partition under root"""
+    if not os.path.isdir(root):
+        return
+    for user in os.scandir(root):
+        if not user.is_dir(follow_symlinks=False) or user.name.startswith('.'):
+            continue
+        for entry in os.scandir(user.path):
+            if entry.is_dir(follow_symlinks=False):
+                day = parse_partition(entry.name)
+                if day is not None:
+                    yield user.name, day, entry.path
+
+
+def undated_paths(root):
+    """Per-user directories that are not date partitions (e.g. highlights/)"""
+    if not os.path.isdir(root):
+        return []
+    paths = []
+    for user in os.scandir(root):
+        if not user.is_dir(follow_symlinks=False) or user.name.startswith('.'):
+            continue
+        for entry in os.scandir(user.path):
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.') \
+                    and parse_partition(entry.name) is None:
+                paths.append(entry.path)
+    return paths
+
+
+def drop_expired_partitions(root, days_old, catalog=None, now=None):
+    """Remove whole date partitions older than days_old, keyed on the directory date
+
+    :param catalog: FsCatalog covering root, used to report sizes without stat-ing
+    :return: (files removed, bytes freed)
+    """
+    cutoff = (now or datetime.now(timezone.utc)).astimezone(timezone.utc).date() - timedelta(days=days_old)
+    removed_files = 0
+    freed = 0
+    for username, day, path in list(iter_partitions(root)):
+        if day >= cutoff:
+            continue
+        if catalog is not None:
+            files, size = catalog.count(under=path), catalog.total_size(under=path)
+        else:
+            files, size = 0, 0
+        try:
+            shutil.rmtree(path)
+            removed_files += files
+            freed += size
+            system_logger.info(f"RETENTION: Dropped partition {username}/{day} ({files} files)")
+        except OSError as e:
+            log_error_with_context(system_logger, e, f"Dropping partition {path}")
+    return removed_files, freed
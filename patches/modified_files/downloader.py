@@ -0,0 +1,289 @@
+## snapchat_dl/downloader.py
+"""File Downlaoder for snapchat_dl."""
+import collections
+import concurrent.futures
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from loguru import logger
+
+
+class DownloadRecord:
+    """Outcome of one media download."""
+
+    def __init__(self, url, dest):
+        self.url = url
+        self.dest = dest
+        self.bytes = 0
+        self.duration = 0.0
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "DownloadRecord({!r}, bytes={}, duration={:.2f}, error={!r})".format(
+            self.dest, self.bytes, self.duration, self.error
+        )
+
+
+def future_record(future):
+    """Return the `DownloadRecord` of a finished future, or None if it was cancelled or raised."""
+    if future.cancelled() or future.exception() is not None:
+        return None
+    return future.result()
+
+
+class DownloadPool:
+    """Process-wide media download pool shared by every user.
+
+    Downloads wait in a per-host queue and only reach the executor once their
+    host has a free slot, so every worker thread is always downloading and
+    `max_workers` is the real concurrency.
+
+    Args:
+        max_workers (int): total concurrent downloads
+        per_host (int): concurrent downloads against a single host
+        queue_size (int): pending downloads accepted before `submit` blocks
+    """
+
+    def __init__(self, max_workers=8, per_host=4, queue_size=64):
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="snapchat-dl"
+        )
+        self._slots = threading.BoundedSemaphore(self.max_workers + max(0, queue_size))
+        self._lock = threading.Lock()
+        self._pending = dict()
+        self._active = dict()
+        self._closed = False
+
+    def _dispatch(self, host):
+        """Hand queued downloads for `host` to the executor while it has free slots.
+
+        Called with `self._lock` held.
+        """
+        pending = self._pending.get(host)
+        while pending and self._active.get(host, 0) < self.per_host:
+            job = pending.popleft()
+            self._active[host] = self._active.get(host, 0) + 1
+            try:
+                self._executor.submit(self._run, host, *job)
+            except BaseException as e:
+                self._active[host] -= 1
+                self._slots.release()
+                if job[0].set_running_or_notify_cancel():
+                    job[0].set_exception(e)
+        if not pending:
+            self._pending.pop(host, None)
+        if not self._active.get(host):
+            self._active.pop(host, None)
+
+    def _run(self, host, future, url, dest, args, kwargs):
+        record = DownloadRecord(url, dest)
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            started = time.monotonic()
+            try:
+                record.bytes = download_url(url, dest, *args, **kwargs) or 0
+            except Exception as e:
+                record.error = "{}: {}".format(type(e).__name__, e)
+            record.duration = time.monotonic() - started
+        finally:
+            with self._lock:
+                self._active[host] -= 1
+                self._dispatch(host)
+            self._slots.release()
+        future.set_result(record)
+
+    def submit(self, url, dest, *args, **kwargs):
+        """Queue a download, blocking while the queue is full.
+
+        Returns:
+            concurrent.futures.Future: resolves to a `DownloadRecord`
+        """
+        self._slots.acquire()
+        future = concurrent.futures.Future()
+        host = urlsplit(url).netloc
+        with self._lock:
+            if self._closed:
+                self._slots.release()
+                self._fail(future, url, dest)
+                return future
+            self._pending.setdefault(host, collections.deque()).append(
+                (future, url, dest, args, kwargs)
+            )
+            self._dispatch(host)
+        return future
+
+    @staticmethod
+    def _fail(future, url, dest):
+        """Resolve a download that will never run with a failed record."""
+        if future.set_running_or_notify_cancel():
+            record = DownloadRecord(url, dest)
+            record.error = "DownloadPool shut down"
+            future.set_result(record)
+
+    def shutdown(self, wait=True):
+        """Stop accepting downloads; queued ones resolve as failed, running ones finish."""
+        with self._lock:
+            self._closed = True
+            queued = [job for pending in self._pending.values() for job in pending]
+            self._pending.clear()
+        for future, url, dest, _, _ in queued:
+            self._slots.release()
+            self._fail(future, url, dest)
+        self._executor.shutdown(wait=wait)
+
+
+PART_SUFFIX = ".part"
+CHUNK_SIZE = 1048576
+MAX_ATTEMPTS = 3
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+def _discard(path):
+    """Remove `path` if it exists."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _expected_size(response, offset):
+    """Return (start, total) for a 200/206 response, total may be None.
+
+    start is None for a 206 without a usable Content-Range.
+    """
+    if response.status_code == requests.codes.get("partial_content"):
+        match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if match is None:
+            return None, None
+        total = match.group(3)
+        return int(match.group(1)), None if total == "*" else int(total)
+
+    length = response.headers.get("Content-Length")
+    return 0, int(length) if length is not None else None
+
+
+def download_url(
+    url: str,
+    dest: str,
+    sleep_interval: int,
+    session=None,
+    max_attempts=MAX_ATTEMPTS,
+    rate_limiter=None,
+):
+    """Download URL to destionation path.
+
+    Media is streamed in fixed-size chunks into `dest + ".part"`, resumed with
+    an HTTP `Range` request after an interrupted transfer, checked against the
+    announced size and only then renamed onto `dest`.
+
+    Args:
+        url (str): url to download
+        dest (str): absolute path to destination
+        session (requests.Session, optional): pooled session to reuse connections
+        max_attempts (int): transfers tried before giving up on `url`
+        rate_limiter (optional): shared limiter, paced on its "media" budget
+
+    Raises:
+        response.raise_for_status: if response is 4** or 50*
+        IOError: if the file is still incomplete after `max_attempts`
+
+    Returns:
+        int: bytes written to `dest` by this call (0 if it already existed)
+    """
+    if os.path.isfile(dest):
+        return 0
+
+    if len(os.path.dirname(dest)) > 0:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+    """Rate limiting."""
+    time.sleep(sleep_interval)
+
+    http = session if session is not None else requests
+    part = dest + PART_SUFFIX
+    written = 0
+
+    for attempt in range(1, max_attempts + 1):
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        # Byte ranges only make sense on the identity encoding
+        headers = {"Accept-Encoding": "identity"}
+        if offset > 0:
+            headers["Range"] = "bytes={}-".format(offset)
+
+        if rate_limiter is not None:
+            rate_limiter.acquire("media")
+
+        try:
+            with http.get(url, headers=headers, stream=True, timeout=10) as response:
+                if response.status_code == requests.codes.get("too_many_requests"):
+                    if rate_limiter is None:
+                        response.raise_for_status()
+                    rate_limiter.throttled("media", response.headers.get("Retry-After"))
+                    continue
+                if response.status_code == requests.codes.get("range_not_satisfiable"):
+                    _discard(part)
+                    continue
+                if response.status_code not in (
+                    requests.codes.get("ok"),
+                    requests.codes.get("partial_content"),
+                ):
+                    response.raise_for_status()
+                    raise IOError("Unexpected status {}".format(response.status_code))
+
+                start, total = _expected_size(response, offset)
+                if response.status_code == requests.codes.get("partial_content") and start != offset:
+                    # A ranged body is only usable if it continues the .part file exactly;
+                    # drop it and fetch the whole file without Range next attempt
+                    _discard(part)
+                    raise IOError(
+                        "Unusable partial response (Content-Range {!r}) for offset {}".format(
+                            response.headers.get("Content-Range"), offset
+                        )
+                    )
+                if start != offset:
+                    # Server ignored the range and sent the whole file; start over
+                    offset = 0
+                mode = "ab" if offset > 0 else "wb"
+
+                with open(part, mode) as handle:
+                    for data in response.iter_content(chunk_size=CHUNK_SIZE):
+                        handle.write(data)
+                        written += len(data)
+
+            size = os.path.getsize(part)
+            if total is not None and size != total:
+                if size > total:
+                    _discard(part)
+                raise IOError(
+                    "Incomplete download: {} of {} bytes".format(size, total)
+                )
+
+            os.replace(part, dest)
+            if rate_limiter is not None:
+                rate_limiter.succeeded("media")
+            return written
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError, IOError) as e:
+            if isinstance(e, requests.exceptions.HTTPError):
+                raise
+            logger.warning(
+                "Download of {} interrupted (attempt {}/{}): {}".format(
+                    os.path.basename(dest), attempt, max_attempts, e
+                )
+            )
+            if attempt < max_attempts:
+                time.sleep(2 ** attempt)
+
+    raise IOError("Giving up on {} after {} attempts".format(dest, max_attempts))
@@ -2,14 +2,19 @@
 """The Main Snapchat Downloader Class."""
 
 import concurrent.futures
+import hashlib
 import json
 import os
 import re
+import time
 
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
 
-from snapchat_dl.downloader import download_url
+from snapchat_dl.downloader import DownloadPool
+from snapchat_dl.downloader import DownloadRecord
+from snapchat_dl.downloader import future_record
 from snapchat_dl.utils import APIResponseError
 from snapchat_dl.utils import dump_response
 from snapchat_dl.utils import MEDIA_TYPE
@@ -17,6 +22,64 @@ from snapchat_dl.utils import NoStoriesFound
 from snapchat_dl.utils import strf_time
 from snapchat_dl.utils import UserNotFoundError
 
+try:
+    import brotli  # noqa: F401 - lets urllib3 decode `br` responses
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+STREAM_CHUNK_SIZE = 16384
+# Bytes still drained after </script> so the connection can return to the pool
+STREAM_DRAIN_LIMIT = 65536
+NEXT_DATA_OPEN = re.compile(rb'<script\s*id="__NEXT_DATA__"\s*type="application/json">')
+NEXT_DATA_CLOSE = b"</script>"
+PAGE_PROPS_KEY = '"pageProps":'
+SNAP_ID_PATTERN = re.compile(r'"snapId"\s*:\s*\{\s*"value"\s*:\s*"([^"]+)"')
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+
+
+def build_session(pool_connections=4, pool_maxsize=10):
+    """Create a keep-alive session with per-host connection pools.
+
+    Args:
+        pool_connections (int): number of hosts to keep pools for
+        pool_maxsize (int): connections kept alive per host
+
+    Returns:
+        requests.Session: session shared by profile and media requests
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive",
+        }
+    )
+    return session
+
+
+def media_identity(media_url):
+    """Return `media_url` without its signed query string."""
+    return media_url.split("?", 1)[0]
+
+
+class ProfileUnchanged(Exception):
+    """Profile has not changed since the previous fetch."""
+
+    pass
+
+
+class ThrottledError(Exception):
+    """Snapchat answered `429 Too Many Requests`."""
+
+    pass
+
 
 class SnapchatDL:
     """Interact with Snapchat API to download story."""
@@ -24,11 +87,19 @@ class SnapchatDL:
     def __init__(
         self,
         directory_prefix=".",
-        max_workers=2,
+        max_workers=8,
         limit_story=-1,
         sleep_interval=1,
         quiet=False,
         dump_json=False,
+        pool_maxsize=10,
+        snap_index=None,
+        per_host_workers=4,
+        queue_size=64,
+        rate_limiter=None,
+        download_highlights=False,
+        metadata_store=None,
+        event_sink=None,
     ):
         self.directory_prefix = os.path.abspath(os.path.normpath(directory_prefix))
         self.max_workers = max_workers
@@ -37,19 +108,132 @@ class SnapchatDL:
         self.quiet = quiet
         self.dump_json = dump_json
         self.endpoint_web = "https://www.snapchat.com/add/{}/"
-        self.regexp_web_json = (
-            r'<script\s*id="__NEXT_DATA__"\s*type="application\/json">([^<]+)<\/script>'
-        )
         self.reaponse_ok = requests.codes.get("ok")
+        self.session = build_session(pool_maxsize=pool_maxsize)
+        self.snap_index = snap_index
+        self.rate_limiter = rate_limiter
+        self.download_highlights = download_highlights
+        self.metadata_store = metadata_store
+        self.event_sink = event_sink
+        self.download_pool = DownloadPool(
+            max_workers=max_workers, per_host=per_host_workers, queue_size=queue_size
+        )
+        self.stage_timings = dict()
+        self.story_timestamps = dict()
+        self.validators = dict()
+        self.fingerprints = dict()
+
+    def _api_response(self, username, timings):
+        """Stream the profile page until `__NEXT_DATA__` is complete.
+
+        Args:
+            username (str): Snapchat `username`
+            timings (dict): receives per-stage timings and byte counts
+
+        Raises:
+            APIResponseError: page ended before a complete `__NEXT_DATA__` tag
+            ProfileUnchanged: server answered `304 Not Modified`
+            ThrottledError: server answered `429 Too Many Requests`
 
-    def _api_response(self, username):
+        Returns:
+            str: raw `__NEXT_DATA__` JSON text
+        """
         web_url = self.endpoint_web.format(username)
-        return requests.get(
-            web_url,
-            headers={
-                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
-            },
-        ).text
+        started = time.perf_counter()
+
+        headers = dict()
+        validators = self.validators.get(username, {})
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        if self.rate_limiter is not None:
+            timings["throttle"] = self.rate_limiter.acquire("profile")
+            started = time.perf_counter()
+
+        with self.session.get(web_url, headers=headers, timeout=30, stream=True) as response:
+            timings["connect"] = time.perf_counter() - started
+            if response.status_code == requests.codes.get("too_many_requests"):
+                if self.rate_limiter is not None:
+                    self.rate_limiter.throttled("profile", response.headers.get("Retry-After"))
+                raise ThrottledError
+            if self.rate_limiter is not None:
+                self.rate_limiter.succeeded("profile")
+            if response.status_code == requests.codes.get("not_modified"):
+                raise ProfileUnchanged
+
+            validators = dict()
+            if response.headers.get("ETag"):
+                validators["etag"] = response.headers["ETag"]
+            if response.headers.get("Last-Modified"):
+                validators["last_modified"] = response.headers["Last-Modified"]
+            self.validators[username] = validators
+
+            chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            buffer = bytearray()
+            start = end = None
+            scanned = 0
+
+            for chunk in chunks:
+                buffer += chunk
+                if start is None:
+                    # Overlap the previous scan so a tag split across chunks is found
+                    match = NEXT_DATA_OPEN.search(buffer, max(0, scanned - 128))
+                    if match is None:
+                        scanned = len(buffer)
+                        continue
+                    start = scanned = match.end()
+                end = buffer.find(NEXT_DATA_CLOSE, max(start, scanned - len(NEXT_DATA_CLOSE)))
+                if end != -1:
+                    break
+                scanned = len(buffer)
+
+            timings["stream"] = time.perf_counter() - started - timings["connect"]
+            timings["bytes"] = len(buffer)
+
+            drained = 0
+            for chunk in chunks:
+                drained += len(chunk)
+                if drained > STREAM_DRAIN_LIMIT:
+                    break
+
+        if start is None or end is None or end == -1:
+            raise APIResponseError
+        return buffer[start:end].decode("utf-8")
+
+    def _fingerprint(self, raw):
+        """Hash the profile's snap ID list without decoding the JSON."""
+        digest = hashlib.sha1(b"profile" if '"userProfile"' in raw else b"missing")
+        for snap_id in SNAP_ID_PATTERN.findall(raw):
+            digest.update(b"\0" + snap_id.encode("utf-8"))
+        return digest.hexdigest()
+
+    def forget_fingerprint(self, username):
+        """Force the next fetch of `username` to be fully processed."""
+        self.fingerprints.pop(username, None)
+        self.validators.pop(username, None)
+
+    def _decode_page_props(self, raw, timings):
+        """Decode only the `pageProps` object out of the `__NEXT_DATA__` text."""
+        started = time.perf_counter()
+        offset = raw.find(PAGE_PROPS_KEY)
+        if offset == -1:
+            page_props = json.loads(raw)["props"]["pageProps"]
+        else:
+            offset += len(PAGE_PROPS_KEY)
+            while raw[offset].isspace():
+                offset += 1
+            page_props, _ = json.JSONDecoder().raw_decode(raw, offset)
+        timings["decode"] = time.perf_counter() - started
+        if not isinstance(page_props, dict):
+            raise ValueError("pageProps is not an object")
+        return page_props
+
+    def close(self):
+        """Finish queued downloads and close pooled connections."""
+        self.download_pool.shutdown(wait=True)
+        self.session.close()
 
     def _web_fetch_story(self, username):
         """Download user stories from Web.
@@ -59,42 +243,239 @@ class SnapchatDL:
 
         Raises:
             APIResponseError: API Error
+            ProfileUnchanged: snap list is identical to the previous fetch
 
         Returns:
-            (dict, dict): user_info, stories
+            (list, dict, list, list): stories, user_info, curated and spotlight highlights
         """
-        response = self._api_response(username)
-        response_json_raw = re.findall(self.regexp_web_json, response)
+        timings = dict()
+        started = time.perf_counter()
 
         try:
-            response_json = json.loads(response_json_raw[0])
+            raw = self._api_response(username, timings)
+
+            fingerprint = self._fingerprint(raw)
+            if self.fingerprints.get(username) == fingerprint:
+                raise ProfileUnchanged
+
+            page_props = self._decode_page_props(raw, timings)
 
-            def util_web_user_info(content: dict):
-                if "userProfile" in content["props"]["pageProps"]:
-                    user_profile = content["props"]["pageProps"]["userProfile"]
+            def util_web_user_info(page_props: dict):
+                if "userProfile" in page_props:
+                    user_profile = page_props["userProfile"]
                     field_id = user_profile["$case"]
                     return user_profile[field_id]
                 else:
                     raise UserNotFoundError
 
-            def util_web_story(content: dict):
-                story_data = content["props"]["pageProps"].get("story")
+            def util_web_story(page_props: dict):
+                story_data = page_props.get("story")
                 if isinstance(story_data, dict) and "snapList" in story_data:
                     return story_data["snapList"]
                 return []
-                 
-            def util_web_extract(content: dict):
-                if "curatedHighlights" in content["props"]["pageProps"]:
-                    return content["props"]["pageProps"]["curatedHighlights"]
-                return list()
-
-            user_info = util_web_user_info(response_json)
-            stories = util_web_story(response_json)
-            curatedHighlights = util_web_extract(response_json)
-            spotHighlights = util_web_extract(response_json)
+
+            def util_web_extract(page_props: dict, key: str):
+                highlights = page_props.get(key)
+                return highlights if isinstance(highlights, list) else list()
+
+            user_info = util_web_user_info(page_props)
+            stories = util_web_story(page_props)
+            curatedHighlights = util_web_extract(page_props, "curatedHighlights")
+            spotHighlights = util_web_extract(page_props, "spotlightHighlights")
+            self.fingerprints[username] = fingerprint
             return stories, user_info, curatedHighlights, spotHighlights
+        except ProfileUnchanged:
+            raise
         except (IndexError, KeyError, ValueError):
+            self.forget_fingerprint(username)
             raise APIResponseError
+        except Exception:
+            self.forget_fingerprint(username)
+            raise
+        finally:
+            timings["total"] = time.perf_counter() - started
+            self.stage_timings[username] = timings
+            logger.debug(
+                "{} fetch timings: {}".format(
+                    username,
+                    ", ".join(
+                        "{}={:.3f}s".format(k, v) if isinstance(v, float) else "{}={}".format(k, v)
+                        for k, v in timings.items()
+                    ),
+                )
+            )
+
+    def _download_done_callback(self, username, snap_id, timestamp, media_url, highlight_id=None):
+        """Return a future callback that records the outcome of one download.
+
+        Args:
+            highlight_id (str): set for highlight media, which is recorded apart from stories
+        """
+
+        def callback(future):
+            record = future_record(future)
+            if record is not None and record.ok:
+                if self.snap_index is None:
+                    return
+                dest = record.dest
+                if highlight_id is not None:
+                    self.snap_index.record_media(snap_id, dest, media_url)
+                    self.snap_index.mark_highlight_seen(username, highlight_id, snap_id)
+                else:
+                    self.snap_index.mark_seen(
+                        username, snap_id, timestamp, path=dest, media_url=media_url
+                    )
+            else:
+                # Retry on the next poll even if the profile looks unchanged
+                self.forget_fingerprint(username)
+
+        return callback
+
+    def _metadata_callback(self, username, date_str, media, snap_user, filename):
+        """Return a future callback that records a snap's metadata once its media is saved."""
+
+        def callback(future):
+            record = future_record(future)
+            if record is None or not record.ok:
+                return
+            if self.metadata_store is not None:
+                self.metadata_store.append(
+                    username, date_str, media, snap_user=snap_user, filename=filename
+                )
+            elif self.dump_json:
+                media_json = dict(media)
+                media_json["snapUser"] = snap_user
+                dump_response(media_json, record.dest + ".json")
+
+        return callback
+
+    def _submit(self, media_url, media_output):
+        return self.download_pool.submit(
+            media_url,
+            media_output,
+            # The shared limiter paces media requests instead of a fixed sleep
+            0 if self.rate_limiter is not None else self.sleep_interval,
+            session=self.session,
+            rate_limiter=self.rate_limiter,
+        )
+
+    @staticmethod
+    def _link_media(source, dest):
+        """Hardlink an already saved media file to `dest`.
+
+        Returns:
+            DownloadRecord: completed record for `dest` (0 bytes transferred)
+        """
+        record = DownloadRecord(source, dest)
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if not os.path.isfile(dest):
+                os.link(source, dest)
+        except OSError as e:
+            record.error = "{}: {}".format(type(e).__name__, e)
+        return record
+
+    def _link_when_done(self, source_future, dest):
+        """Link `dest` to the file of a download that is still in flight."""
+        linked = concurrent.futures.Future()
+
+        def callback(future):
+            # Resolve `linked` on every path; whoever awaits it would hang otherwise
+            try:
+                source = future_record(future)
+                if source is not None and source.ok:
+                    linked.set_result(self._link_media(source.dest, dest))
+                    return
+                record = DownloadRecord(source.url if source is not None else None, dest)
+                if source is not None:
+                    record.error = source.error
+                elif future.cancelled():
+                    record.error = "source download cancelled"
+                else:
+                    record.error = "{}: {}".format(type(future.exception()).__name__, future.exception())
+                linked.set_result(record)
+            except Exception as e:
+                if not linked.done():
+                    linked.set_exception(e)
+
+        source_future.add_done_callback(callback)
+        return linked
+
+    def _queue_highlights(self, username, highlights, in_flight):
+        """Queue highlight media, reusing anything already saved from the story feed.
+
+        Args:
+            username (str): Snapchat `username`
+            highlights (list): curated and spotlight highlights from the profile
+            in_flight (dict): snapId/media URL -> future of story downloads queued now
+
+        Returns:
+            list: futures resolving to a `DownloadRecord` per highlight media
+        """
+        queued = list()
+        linked = 0
+        for position, highlight in enumerate(highlights):
+            highlight_id = (highlight.get("highlightId") or {}).get("value") or str(position)
+            dir_name = os.path.join(
+                self.directory_prefix, username, "highlights", re.sub(r"[^\w\-.]", "_", highlight_id)
+            )
+
+            for media in highlight.get("snapList") or []:
+                try:
+                    snap_id = media["snapId"]["value"]
+                    media_url = media["snapUrls"]["mediaUrl"]
+                    media_type = media["snapMediaType"]
+                    timestamp = int(media["timestampInSec"]["value"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+                filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S {} {}.{}").format(
+                    snap_id, username, MEDIA_TYPE[media_type]
+                )
+                media_output = os.path.join(dir_name, filename)
+                if os.path.isfile(media_output):
+                    continue
+                # Retention deletes old highlight files; the index remembers they were saved
+                if self.snap_index is not None and self.snap_index.is_highlight_seen(
+                    username, highlight_id, snap_id
+                ):
+                    continue
+
+                done_callback = self._download_done_callback(
+                    username, snap_id, timestamp, media_url, highlight_id=highlight_id
+                )
+
+                source_future = in_flight.get(snap_id) or in_flight.get(media_identity(media_url))
+                if source_future is not None:
+                    future = self._link_when_done(source_future, media_output)
+                    future.add_done_callback(done_callback)
+                    queued.append(future)
+                    linked += 1
+                    continue
+
+                existing = None
+                if self.snap_index is not None:
+                    existing = self.snap_index.find_media(snap_id, media_url)
+                if existing is not None:
+                    future = concurrent.futures.Future()
+                    future.set_result(self._link_media(existing, media_output))
+                    future.add_done_callback(done_callback)
+                    queued.append(future)
+                    linked += 1
+                    continue
+
+                future = self._submit(media_url, media_output)
+                future.add_done_callback(done_callback)
+                in_flight[snap_id] = in_flight[media_identity(media_url)] = future
+                queued.append(future)
+
+        if queued:
+            logger.info(
+                "[+] {} highlights: {} new media, {} linked to saved snaps".format(
+                    username, len(queued) - linked, linked
+                )
+            )
+        return queued
 
     def download(self, username):
         """Download Snapchat Story for `username`.
@@ -103,11 +484,19 @@ class SnapchatDL:
             username (str): Snapchat `username`
 
         Returns:
-            [bool]: story downloader
+            list: futures resolving to a `DownloadRecord` per queued media
         """
-        stories, snap_user, *_ = self._web_fetch_story(username)
+        stories, snap_user, curated_highlights, spot_highlights = self._web_fetch_story(
+            username
+        )
+        self.story_timestamps[username] = [
+            int(media["timestampInSec"]["value"]) for media in stories
+        ]
+        highlights = list()
+        if self.download_highlights:
+            highlights = curated_highlights + spot_highlights
 
-        if len(stories) == 0:
+        if len(stories) == 0 and len(highlights) == 0:
             if self.quiet is False:
                 logger.info("\033[91m{}\033[0m has no stories".format(username))
 
@@ -116,35 +505,55 @@ class SnapchatDL:
         if self.limit_story > -1:
             stories = stories[0 : self.limit_story]
 
-        logger.info("[+] {} has {} stories".format(username, len(stories)))
+        if self.snap_index is not None:
+            fresh = [
+                media
+                for media in stories
+                if not self.snap_index.is_seen(username, media["snapId"]["value"])
+            ]
+            logger.info(
+                "[+] {} has {} stories, {} new".format(username, len(stories), len(fresh))
+            )
+            stories = fresh
+        else:
+            logger.info("[+] {} has {} stories".format(username, len(stories)))
 
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
-        try:
-            for media in stories:
-                snap_id = media["snapId"]["value"]
-                media_url = media["snapUrls"]["mediaUrl"]
-                media_type = media["snapMediaType"]
-                timestamp = int(media["timestampInSec"]["value"])
-                date_str = strf_time(timestamp, "%Y-%m-%d")
+        queued = list()
+        in_flight = dict()
+        for media in stories:
+            snap_id = media["snapId"]["value"]
+            media_url = media["snapUrls"]["mediaUrl"]
+            media_type = media["snapMediaType"]
+            timestamp = int(media["timestampInSec"]["value"])
+            date_str = strf_time(timestamp, "%Y-%m-%d")
 
-                dir_name = os.path.join(self.directory_prefix, username, date_str)
+            dir_name = os.path.join(self.directory_prefix, username, date_str)
 
-                filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S {} {}.{}").format(
-                    snap_id, username, MEDIA_TYPE[media_type]
-                )
+            filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S {} {}.{}").format(
+                snap_id, username, MEDIA_TYPE[media_type]
+            )
 
-                if self.dump_json:
-                    filename_json = os.path.join(dir_name, filename + ".json")
-                    media_json = dict(media)
-                    media_json["snapUser"] = snap_user
-                    dump_response(media_json, filename_json)
-
-                media_output = os.path.join(dir_name, filename)
-                executor.submit(
-                    download_url, media_url, media_output, self.sleep_interval
+            media_output = os.path.join(dir_name, filename)
+            if self.event_sink is not None:
+                self.event_sink(
+                    "snap_discovered",
+                    username=username,
+                    snap_id=snap_id,
+                    timestamp=timestamp,
+                    path=media_output,
                 )
+            future = self._submit(media_url, media_output)
+            future.add_done_callback(
+                self._download_done_callback(username, snap_id, timestamp, media_url)
+            )
+            future.add_done_callback(
+                self._metadata_callback(username, date_str, media, snap_user, filename)
+            )
+            in_flight[snap_id] = in_flight[media_identity(media_url)] = future
+            queued.append(future)
 
-        except KeyboardInterrupt:
-            executor.shutdown(wait=False)
+        logger.info("[✔] {} queued {} stories".format(username, len(queued)))
 
-        logger.info("[✔] {} stories downloaded".format(username, len(stories))) 
\ No newline at end of file
+        if highlights:
+            queued.extend(self._queue_highlights(username, highlights, in_flight))
+        return queued
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Background pipeline stages for snap-tracker
+Each stage owns a bounded queue and one worker thread, so a slow stage
+(e.g. a GitHub push) never holds up the stages before or beside it
+"""
+
+import time
+import queue
+import threading
+from logger_config import system_logger, log_error_with_context
+
+
+class Stage:
+    """One worker thread fed through a bounded queue."""
+
+    def __init__(self, name, handler, maxsize=32, coalesce=False, linger=0.0):
+        """
+        :param handler: called with one item, or with a list of items when coalescing
+        :param coalesce: hand everything queued so far to the handler in one call
+        :param linger: when coalescing, seconds to keep collecting after the first item
+        """
+        self.name = name
+        self.handler = handler
+        self.coalesce = coalesce
+        self.linger = linger
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name=f"stage-{name}", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        """Queue an item; blocks while the stage is full (backpressure)"""
+        if self.queue.full():
+            system_logger.warning(f"PIPELINE: {self.name} queue full ({self.queue.maxsize}), waiting")
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            items = [item]
+            if self.coalesce:
+                deadline = time.monotonic() + self.linger
+                while True:
+                    try:
+                        remaining = deadline - time.monotonic()
+                        if remaining > 0:
+                            items.append(self.queue.get(timeout=remaining))
+                        else:
+                            items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+            try:
+                self.handler(items if self.coalesce else item)
+            except Exception as e:
+                log_error_with_context(system_logger, e, f"Pipeline stage {self.name}")
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def join(self):
+        """Wait until everything queued so far has been handled"""
+        self.queue.join()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Adaptive polling scheduler for snap-tracker
+Keeps a priority queue of usernames ordered by their next due time, learns
+each user's posting rate from story timestamps and spends a global
+requests-per-minute budget on the users most likely to have something new
+"""
+
+import os
+import json
+import time
+import heapq
+from dotenv import load_dotenv
+from logger_config import snapchat_logger, log_error_with_context
+
+# Load environment variables
+load_dotenv()
+
+# Learned per-user state survives restarts here
+POLL_STATE_FILE = os.getenv('POLL_STATE_FILE', 'data/poll_state.json')
+
+STORY_TTL_SECONDS = 24 * 60 * 60
+
+DEFAULT_INTERVAL = 30 * 60      # Users we know nothing about yet
+MIN_INTERVAL = 5 * 60           # Never poll a user more often than this
+MAX_INTERVAL = 6 * 60 * 60      # Never leave a user alone longer than this
+FAILURE_INTERVAL = 10 * 60      # First retry delay after a failed fetch
+THROTTLED_INTERVAL = 10 * 60    # Retry delay after throttling or a transient network error
+FAILURE_THRESHOLD = 3           # Consecutive failures that open a user's circuit
+QUARANTINE_INTERVAL = 6 * 60 * 60
+QUARANTINE_MAX = 24 * 60 * 60
+DORMANT_BACKOFF = 1.5           # Interval growth when a user has nothing new
+EXPIRY_LEAD = 30 * 60           # Poll this long before the newest story expires
+HISTORY_LIMIT = 50              # Post timestamps kept per user
+HISTORY_WINDOW = 7 * 24 * 60 * 60
+
+
+class UserSchedule:
+    """Polling state learned for one username."""
+
+    def __init__(self, username, interval=DEFAULT_INTERVAL, next_due=0.0, posts=None,
+                 failures=0, quarantines=0):
+        self.username = username
+        self.interval = interval
+        self.next_due = next_due
+        self.posts = sorted(posts or [])
+        # Circuit breaker: consecutive failures and how often the circuit opened in a row
+        self.failures = failures
+        self.quarantines = quarantines
+
+    @property
+    def quarantined(self):
+        return self.failures >= FAILURE_THRESHOLD
+
+    def failure_delay(self):
+        """Retry delay after another consecutive failure"""
+        if self.quarantined:
+            # Circuit open: leave the user alone, then let one probe through
+            return min(QUARANTINE_MAX, QUARANTINE_INTERVAL * (2 ** max(0, self.quarantines - 1)))
+        return FAILURE_INTERVAL * (2 ** (self.failures - 1))
+
+    @property
+    def newest_expiry(self):
+        """Unix time at which the newest known story expires, or None"""
+        return self.posts[-1] + STORY_TTL_SECONDS if self.posts else None
+
+    def learn(self, timestamps, now):
+        """Merge story timestamps and return how many were not seen before"""
+        known = set(self.posts)
+        fresh = [int(t) for t in timestamps if int(t) not in known]
+        cutoff = now - HISTORY_WINDOW
+        self.posts = sorted(t for t in known.union(fresh) if t >= cutoff)[-HISTORY_LIMIT:]
+        return len(fresh)
+
+    def posting_gap(self):
+        """Mean seconds between posts, or None with too little history"""
+        if len(self.posts) < 2:
+            return None
+        return (self.posts[-1] - self.posts[0]) / (len(self.posts) - 1)
+
+    def to_dict(self):
+        return {'interval': self.interval, 'next_due': self.next_due, 'posts': self.posts,
+                'failures': self.failures, 'quarantines': self.quarantines}
+
+
+class PollScheduler:
+    """Priority queue of usernames with a global requests-per-minute budget."""
+
+    def __init__(self, usernames, requests_per_minute=30, state_file=POLL_STATE_FILE):
+        self.requests_per_minute = max(1, int(requests_per_minute))
+        self.state_file = state_file
+        self.users = {}
+        self._heap = []
+        self._tokens = float(self.requests_per_minute)
+        self._refilled_at = time.monotonic()
+        self._load_state()
+        self.sync(usernames)
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                data = json.load(f)
+            for username, state in data.items():
+                self.users[username] = UserSchedule(username, **state)
+            snapchat_logger.debug(f"SCHEDULER: Loaded state for {len(self.users)} users")
+        except Exception as e:
+            log_error_with_context(snapchat_logger, e, "Loading poll scheduler state")
+            self.users = {}
+
+    def save_state(self):
+        """Persist learned intervals and post history"""
+        if not self.state_file:
+            return
+        try:
+            if os.path.dirname(self.state_file):
+                os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            tmp_path = self.state_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({u: s.to_dict() for u, s in self.users.items()}, f)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            log_error_with_context(snapchat_logger, e, "Saving poll scheduler state")
+
+    def sync(self, usernames):
+        """Track exactly these usernames; new ones are due immediately"""
+        wanted = set(usernames)
+        for username in list(self.users):
+            if username not in wanted:
+                del self.users[username]
+        for username in wanted:
+            if username not in self.users:
+                self.users[username] = UserSchedule(username)
+        self._heap = []
+        for schedule in self.users.values():
+            self._push(schedule)
+
+    def _priority(self, schedule):
+        # Earlier due time first; ties go to the user whose story expires first
+        expiry = schedule.newest_expiry
+        return (schedule.next_due, expiry if expiry is not None else float('inf'))
+
+    def _push(self, schedule):
+        heapq.heappush(self._heap, (*self._priority(schedule), schedule.username))
+
+    def _refill(self):
+        now = time.monotonic()
+        rate = self.requests_per_minute / 60.0
+        self._tokens = min(float(self.requests_per_minute), self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+
+    def due(self, now=None):
+        """Pop the usernames due now, limited by the request budget"""
+        now = now if now is not None else time.time()
+        self._refill()
+        batch = []
+        while self._heap and self._tokens >= 1:
+            next_due, _, username = self._heap[0]
+            schedule = self.users.get(username)
+            if schedule is None or next_due != schedule.next_due:
+                heapq.heappop(self._heap)  # Stale entry
+                continue
+            if next_due > now:
+                break
+            heapq.heappop(self._heap)
+            self._tokens -= 1
+            batch.append(username)
+        return batch
+
+    def next_wakeup(self, now=None):
+        """Seconds until the next user is due or a request token is available"""
+        now = now if now is not None else time.time()
+        self._refill()
+        wait_for_user = max(0.0, self._heap[0][0] - now) if self._heap else float(MAX_INTERVAL)
+        wait_for_token = 0.0
+        if self._tokens < 1:
+            wait_for_token = (1 - self._tokens) * 60.0 / self.requests_per_minute
+        return max(wait_for_user, wait_for_token)
+
+    def record(self, username, timestamps=None, failed=False, throttled=False, now=None):
+        """Reschedule a user after a poll
+
+        :param timestamps: timestampInSec values of the stories currently live
+        :param failed: the poll failed for a reason specific to this user
+        :param throttled: Snapchat throttled the poll or it hit a transient (network,
+                          partial download) error; retried, not held against the user
+        """
+        now = now if now is not None else time.time()
+        schedule = self.users.get(username)
+        if schedule is None:
+            return
+
+        if throttled:
+            delay = THROTTLED_INTERVAL
+        elif failed:
+            schedule.failures += 1
+            if schedule.failures == FAILURE_THRESHOLD:
+                schedule.quarantines += 1
+                snapchat_logger.warning(
+                    f"SCHEDULER: {username} quarantined after {schedule.failures} consecutive failures"
+                )
+            elif schedule.failures > FAILURE_THRESHOLD:
+                # Half-open probe failed; stay quarantined for longer
+                schedule.quarantines += 1
+            delay = schedule.failure_delay()
+        else:
+            if schedule.quarantined:
+                snapchat_logger.info(f"SCHEDULER: {username} recovered, leaving quarantine")
+            schedule.failures = 0
+            schedule.quarantines = 0
+            fresh = schedule.learn(timestamps or [], now)
+            gap = schedule.posting_gap()
+            if fresh and gap is not None:
+                # Active user: poll about twice per posting gap
+                schedule.interval = gap / 2
+            elif fresh:
+                schedule.interval = DEFAULT_INTERVAL
+            else:
+                schedule.interval *= DORMANT_BACKOFF
+            schedule.interval = min(MAX_INTERVAL, max(MIN_INTERVAL, schedule.interval))
+            delay = schedule.interval
+
+        schedule.next_due = now + delay
+        expiry = schedule.newest_expiry
+        if (not schedule.quarantined and expiry is not None
+                and now < expiry - EXPIRY_LEAD < schedule.next_due):
+            # Look again shortly before the newest story disappears
+            schedule.next_due = expiry - EXPIRY_LEAD
+        self._push(schedule)
+        snapchat_logger.debug(
+            f"SCHEDULER: {username} next poll in {(schedule.next_due - now) / 60:.1f} min "
+            f"(interval {schedule.interval / 60:.1f} min, failures {schedule.failures})"
+        )
+
+    def quarantined(self):
+        """Usernames whose circuit is currently open"""
+        return sorted(u for u, s in self.users.items() if s.quarantined)
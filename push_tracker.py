@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Pushed-files tracker for snap-tracker
+Records the hash and stat of every file pushed to GitHub in SQLite (WAL),
+outside logs/ so log retention never resets it. Rows are upserted per file
+and only after the push that carried them succeeded
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from dotenv import load_dotenv
+from logger_config import system_logger, log_error_with_context
+
+# Load environment variables
+load_dotenv()
+
+PUSHED_FILES_DB = os.getenv('PUSHED_FILES_DB', 'data/pushed_files.db')
+
+# Where the tracker used to live; imported once, then renamed
+LEGACY_TRACKER_JSON = 'logs/pushed_files_tracker.json'
+
+COLUMNS = ('hash', 'algorithm', 'size', 'mtime', 'mtime_ns', 'inode')
+
+
+class PushTracker:
+    """Indexed store of pushed files keyed by path relative to the repo."""
+
+    def __init__(self, path=PUSHED_FILES_DB, legacy_json=LEGACY_TRACKER_JSON):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pushed_files ('
+            ' path TEXT PRIMARY KEY,'
+            ' hash TEXT NOT NULL,'
+            ' algorithm TEXT,'
+            ' size INTEGER,'
+            ' mtime REAL,'
+            ' mtime_ns INTEGER,'
+            ' inode INTEGER'
+            ') WITHOUT ROWID'
+        )
+        # Small key/value state, e.g. the last commit the remote acknowledged
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+        if legacy_json and os.path.exists(legacy_json):
+            self._migrate(legacy_json)
+
+    def _migrate(self, legacy_json):
+        """One-time import of the old JSON tracker"""
+        try:
+            with open(legacy_json, 'r') as f:
+                data = json.load(f)
+            # Old entries without an algorithm were MD5
+            self.record({path: dict({'algorithm': 'md5'}, **entry) for path, entry in data.items()})
+            os.replace(legacy_json, legacy_json + '.migrated')
+            system_logger.info(f"PUSH TRACKER: Migrated {len(data)} entries from {legacy_json}")
+        except Exception as e:
+            log_error_with_context(system_logger, e, f"Migrating {legacy_json}")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM pushed_files').fetchone()[0]
+
+    def get(self, path):
+        """The pushed record of a path as a dict, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM pushed_files WHERE path = ?", (path,)
+            ).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def record(self, entries, forget=()):
+        """Upsert records and drop forgotten paths in one transaction
+
+        :param entries: {path: {'hash': ..., 'size': ..., ...}}
+        :param forget: paths no longer on disk
+        """
+        rows = [
+            (path,) + tuple(entry.get(column) for column in COLUMNS)
+            for path, entry in entries.items()
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO pushed_files (path, {', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.executemany('DELETE FROM pushed_files WHERE path = ?', [(path,) for path in forget])
+        if rows or forget:
+            system_logger.info(f"PUSH TRACKER: Recorded {len(rows)} files, forgot {len(forget)}")
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            with self._conn:
+                self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def paths(self):
+        with self._lock:
+            return {row[0] for row in self._conn.execute('SELECT path FROM pushed_files')}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Shared rate limiter for Snapchat endpoints
+One token bucket per endpoint class (profile pages, CDN media) with
+Retry-After-aware, jittered exponential backoff when Snapchat throttles us
+"""
+
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from logger_config import snapchat_logger
+
+# Endpoint classes
+PROFILE = 'profile'
+MEDIA = 'media'
+
+BACKOFF_BASE = 5.0          # Seconds for the first throttle without Retry-After
+BACKOFF_MAX = 15 * 60.0     # Never back off longer than this
+
+
+def parse_retry_after(value):
+    """Return the Retry-After header as seconds, or None if absent/invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class EndpointBucket:
+    """Token bucket plus backoff state for one endpoint class."""
+
+    def __init__(self, name, per_minute, burst=None):
+        self.name = name
+        self.rate = max(1, per_minute) / 60.0
+        self.capacity = float(burst if burst is not None else max(1, per_minute // 6))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.consecutive_throttles = 0
+        # Monitoring counters
+        self.requests = 0
+        self.throttles = 0
+        self.waited = 0.0
+
+    def reserve(self, now):
+        """Take a token and return how long the caller must wait before using it"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        self.requests += 1
+        # Callers queued behind a backoff are still spaced out by the token rate
+        return max(0.0, self.blocked_until - now) + max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Thread-safe limiter shared by profile fetches and media downloads."""
+
+    def __init__(self, profile_per_minute=30, media_per_minute=120):
+        self._lock = threading.Lock()
+        self._buckets = {
+            PROFILE: EndpointBucket(PROFILE, profile_per_minute),
+            MEDIA: EndpointBucket(MEDIA, media_per_minute),
+        }
+
+    def acquire(self, endpoint):
+        """Block until a request to this endpoint class is allowed"""
+        bucket = self._buckets[endpoint]
+        with self._lock:
+            wait = bucket.reserve(time.monotonic())
+            bucket.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self, endpoint, retry_after=None):
+        """Record a 429 and push the endpoint's next allowed request back
+
+        :param retry_after: raw Retry-After header value, if any
+        :return: seconds the endpoint is now blocked for
+        """
+        bucket = self._buckets[endpoint]
+        server_delay = parse_retry_after(retry_after)
+        with self._lock:
+            bucket.throttles += 1
+            bucket.consecutive_throttles += 1
+            backoff = BACKOFF_BASE * (2 ** (bucket.consecutive_throttles - 1))
+            delay = min(BACKOFF_MAX, backoff * random.uniform(0.5, 1.5))
+            if server_delay is not None:
+                delay = max(delay, server_delay)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+        snapchat_logger.warning(
+            f"RATE LIMIT: {endpoint} throttled (#{bucket.consecutive_throttles}, "
+            f"Retry-After={retry_after}), backing off {delay:.1f}s"
+        )
+        return delay
+
+    def succeeded(self, endpoint):
+        """Reset the backoff after a request went through"""
+        bucket = self._buckets[endpoint]
+        with self._lock:
+            bucket.consecutive_throttles = 0
+
+    def stats(self):
+        """Counters per endpoint class for monitoring"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    'requests': bucket.requests,
+                    'throttled': bucket.throttles,
+                    'waited_seconds': round(bucket.waited, 1),
+                    'blocked_for': round(max(0.0, bucket.blocked_until - now), 1),
+                }
+                for name, bucket in self._buckets.items()
+            }
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Persistent index of downloaded snapIds for snap-tracker
+Lets the downloader skip snaps it already saved before touching the disk or
+the network, even after cleanup_manager has removed the media files
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from logger_config import snapchat_logger, log_error_with_context
+
+# Load environment variables
+load_dotenv()
+
+# Kept outside logs/ so log retention never resets it
+SNAP_INDEX_DB = os.getenv('SNAP_INDEX_DB', 'data/snap_index.db')
+
+# Stories expire 24h after posting; keep an extra hour for clock skew
+STORY_TTL_SECONDS = 24 * 60 * 60
+PRUNE_GRACE_SECONDS = 60 * 60
+
+# Saved media stays linkable (e.g. from highlights) as long as downloads are kept
+MEDIA_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+
+def media_key(media_url):
+    """Identity of a media URL, ignoring its signed query string"""
+    parts = urlsplit(media_url)
+    return f"{parts.netloc}{parts.path}"
+
+
+class SnapIndex:
+    """SQLite-backed set of (username, snapId) pairs with an in-memory cache."""
+
+    def __init__(self, path=SNAP_INDEX_DB):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen_snaps ('
+            ' username TEXT NOT NULL,'
+            ' snap_id TEXT NOT NULL,'
+            ' posted_at INTEGER NOT NULL,'
+            ' PRIMARY KEY (username, snap_id)'
+            ') WITHOUT ROWID'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS media_files ('
+            ' snap_id TEXT NOT NULL,'
+            ' media_key TEXT NOT NULL,'
+            ' path TEXT NOT NULL,'
+            ' saved_at INTEGER NOT NULL'
+            ')'
+        )
+        # Highlights never expire, so their entries outlive the files retention deletes
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen_highlights ('
+            ' username TEXT NOT NULL,'
+            ' highlight_id TEXT NOT NULL,'
+            ' snap_id TEXT NOT NULL,'
+            ' saved_at INTEGER NOT NULL,'
+            ' PRIMARY KEY (username, highlight_id, snap_id)'
+            ') WITHOUT ROWID'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS media_files_snap ON media_files (snap_id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS media_files_key ON media_files (media_key)')
+        self._conn.commit()
+        self._seen = set(self._conn.execute('SELECT username, snap_id FROM seen_snaps'))
+        self._seen_highlights = set(
+            self._conn.execute('SELECT username, highlight_id, snap_id FROM seen_highlights')
+        )
+        snapchat_logger.debug(f"SNAP INDEX: Loaded {len(self._seen)} entries from {path}")
+
+    def __len__(self):
+        return len(self._seen)
+
+    def is_seen(self, username, snap_id):
+        """Return True if the snap was already downloaded for this user"""
+        return (username, snap_id) in self._seen
+
+    def mark_seen(self, username, snap_id, posted_at, path=None, media_url=None):
+        """Record a completed download; posted_at is the snap's timestampInSec
+
+        :param path: where the media was saved, so other sources can link to it
+        :param media_url: the URL it was fetched from
+        """
+        with self._lock:
+            try:
+                if (username, snap_id) not in self._seen:
+                    self._conn.execute(
+                        'INSERT OR IGNORE INTO seen_snaps (username, snap_id, posted_at) VALUES (?, ?, ?)',
+                        (username, snap_id, int(posted_at))
+                    )
+                if path is not None:
+                    self._insert_media(snap_id, path, media_url)
+                self._conn.commit()
+                self._seen.add((username, snap_id))
+            except sqlite3.Error as e:
+                log_error_with_context(snapchat_logger, e, f"Recording snap {snap_id} for {username}")
+
+    def _insert_media(self, snap_id, path, media_url):
+        self._conn.execute(
+            'INSERT INTO media_files (snap_id, media_key, path, saved_at) VALUES (?, ?, ?, ?)',
+            (snap_id, media_key(media_url) if media_url else '', path, int(time.time()))
+        )
+
+    def record_media(self, snap_id, path, media_url=None):
+        """Remember where a snap's media was saved without marking it as a seen story"""
+        with self._lock:
+            try:
+                self._insert_media(snap_id, path, media_url)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                log_error_with_context(snapchat_logger, e, f"Recording media for snap {snap_id}")
+
+    def is_highlight_seen(self, username, highlight_id, snap_id):
+        """Return True if this highlight snap was saved before, even if the file is gone"""
+        return (username, highlight_id, snap_id) in self._seen_highlights
+
+    def mark_highlight_seen(self, username, highlight_id, snap_id):
+        """Record a saved highlight snap; kept by prune() so it is never fetched again"""
+        with self._lock:
+            try:
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO seen_highlights (username, highlight_id, snap_id, saved_at)'
+                    ' VALUES (?, ?, ?, ?)',
+                    (username, highlight_id, snap_id, int(time.time()))
+                )
+                self._conn.commit()
+                self._seen_highlights.add((username, highlight_id, snap_id))
+            except sqlite3.Error as e:
+                log_error_with_context(snapchat_logger, e, f"Recording highlight snap {snap_id} for {username}")
+
+    def find_media(self, snap_id, media_url=None):
+        """Return the path of an existing file holding this snap's media, or None"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path FROM media_files WHERE snap_id = ? OR media_key = ? ORDER BY saved_at',
+                (snap_id, media_key(media_url) if media_url else None)
+            ).fetchall()
+        for (path,) in rows:
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def prune(self, now=None):
+        """Drop snaps whose story has expired and can no longer be served
+
+        Highlight entries are left alone: highlights stay on the profile.
+        """
+        cutoff = int((now or time.time()) - STORY_TTL_SECONDS - PRUNE_GRACE_SECONDS)
+        with self._lock:
+            try:
+                expired = self._conn.execute(
+                    'SELECT username, snap_id FROM seen_snaps WHERE posted_at < ?', (cutoff,)
+                ).fetchall()
+                if expired:
+                    self._conn.execute('DELETE FROM seen_snaps WHERE posted_at < ?', (cutoff,))
+                    self._seen.difference_update(expired)
+                    snapchat_logger.info(f"SNAP INDEX: Pruned {len(expired)} expired entries")
+                media_cutoff = int((now or time.time()) - MEDIA_RETENTION_SECONDS)
+                self._conn.execute('DELETE FROM media_files WHERE saved_at < ?', (media_cutoff,))
+                self._conn.commit()
+                return len(expired)
+            except sqlite3.Error as e:
+                log_error_with_context(snapchat_logger, e, "Pruning snap index")
+                return 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
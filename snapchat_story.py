@@ -1,8 +1,13 @@
 import os
-import subprocess
-import threading
 from dotenv import load_dotenv
 import time
+from snap_index import SnapIndex
+from poll_scheduler import PollScheduler
+from rate_limiter import RateLimiter
+from media_store import MediaStore
+from metadata_store import MetadataStore
+from event_stream import EventPublisher
+from story_engine import StoryEngine, scan_prefix_usernames, DEFAULT_CONCURRENCY
 from logger_config import snapchat_logger, log_error_with_context, log_function_entry, log_function_exit
 
 # Load environment variables from .env
@@ -16,72 +21,94 @@ DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', './downloads')
 
 usernames = USERNAME.split()
 
+# Number of profiles fetched at once and media downloads shared by all users
+CONCURRENCY = int(os.getenv('SNAPCHAT_CONCURRENCY', DEFAULT_CONCURRENCY))
+MAX_WORKERS = int(os.getenv('SNAPCHAT_MAX_WORKERS', 8))
+PER_HOST_WORKERS = int(os.getenv('SNAPCHAT_PER_HOST_DOWNLOADS', 4))
+DOWNLOAD_QUEUE = int(os.getenv('SNAPCHAT_DOWNLOAD_QUEUE', 64))
+
+# Separate request budgets for profile pages and CDN media
+PROFILE_REQUESTS_PER_MINUTE = int(os.getenv('SNAPCHAT_PROFILE_RATE', 30))
+MEDIA_REQUESTS_PER_MINUTE = int(os.getenv('SNAPCHAT_MEDIA_RATE', 120))
+
+rate_limiter = RateLimiter(profile_per_minute=PROFILE_REQUESTS_PER_MINUTE,
+                           media_per_minute=MEDIA_REQUESTS_PER_MINUTE)
+
+# Also save highlights under <username>/highlights/<highlightId>/
+DOWNLOAD_HIGHLIGHTS = os.getenv('SNAPCHAT_DOWNLOAD_HIGHLIGHTS', 'false').lower() in ('1', 'true', 'yes')
+
+# Snaps already downloaded are skipped before any directory or media request
+snap_index = SnapIndex()
+
+engine = StoryEngine(DOWNLOAD_DIR, concurrency=CONCURRENCY, max_workers=MAX_WORKERS,
+                     per_host_workers=PER_HOST_WORKERS, queue_size=DOWNLOAD_QUEUE,
+                     metadata_store=MetadataStore(DOWNLOAD_DIR), snap_index=snap_index,
+                     rate_limiter=rate_limiter,
+                     download_highlights=DOWNLOAD_HIGHLIGHTS, media_store=MediaStore(),
+                     event_publisher=EventPublisher())
+
 # Removed log trimming - handled by RotatingFileHandler in logger_config
 
-def download_snapchat_stories():
-    """Run the snapchat-dl command to download stories."""
-    log_function_entry(snapchat_logger, "download_snapchat_stories", usernames=usernames)
+# Global request budget shared by all tracked users
+REQUESTS_PER_MINUTE = int(os.getenv('SNAPCHAT_REQUESTS_PER_MINUTE', 30))
+
+# Longest idle sleep, so new user folders are picked up promptly
+MAX_IDLE_SLEEP = 60
+
+def tracked_usernames():
+    """Configured usernames plus any user folders already in the download directory."""
+    return list(dict.fromkeys(usernames + scan_prefix_usernames(DOWNLOAD_DIR)))
+
+def download_snapchat_stories(targets):
+    """Run one in-process download pass for the given usernames."""
+    log_function_entry(snapchat_logger, "download_snapchat_stories", usernames=targets)
     
     snapchat_logger.info("SNAPCHAT-DL: Starting story download process")
-    snapchat_logger.info(f"Target usernames: {usernames}")
+    snapchat_logger.info(f"Target usernames: {targets}")
     snapchat_logger.info(f"Download directory: {DOWNLOAD_DIR}")
 
-    command = ['snapchat-dl'] + usernames + ['-u', '-P', DOWNLOAD_DIR, '-d', '-s']
-    snapchat_logger.info(f"Command: {' '.join(command)}")
-
     try:
         # Create download directory if it doesn't exist
         os.makedirs(DOWNLOAD_DIR, exist_ok=True)
         snapchat_logger.debug(f"Ensured download directory exists: {DOWNLOAD_DIR}")
         
-        # Run snapchat-dl with detailed logging
-        snapchat_logger.info("SNAPCHAT-DL: Executing download command...")
-        
-        process = subprocess.Popen(
-            command, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        # Log output in real-time
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                snapchat_logger.info(f"SNAPCHAT-DL OUTPUT: {output.strip()}")
-        
-        # Get any remaining output
-        stdout, stderr = process.communicate()
+        snapchat_logger.info(f"SNAPCHAT-DL: Downloading {len(targets)} users (concurrency {engine.concurrency})")
         
-        if stdout:
-            for line in stdout.splitlines():
-                if line.strip():
-                    snapchat_logger.info(f"SNAPCHAT-DL STDOUT: {line}")
-        
-        if stderr:
-            for line in stderr.splitlines():
-                if line.strip():
-                    snapchat_logger.error(f"SNAPCHAT-DL STDERR: {line}")
-
-        if process.returncode == 0:
-            snapchat_logger.info("SNAPCHAT-DL SUCCESS: Story download completed")
-            log_function_exit(snapchat_logger, "download_snapchat_stories", "success")
-            return True
-        else:
-            snapchat_logger.error(f"SNAPCHAT-DL FAILED: Exit code {process.returncode}")
-            log_function_exit(snapchat_logger, "download_snapchat_stories", "failed")
-            return False
-            
-    except FileNotFoundError:
-        snapchat_logger.error("SNAPCHAT-DL ERROR: snapchat-dl command not found - is it installed?")
-        return False
+        results = engine.run(targets)
     except Exception as e:
         log_error_with_context(snapchat_logger, e, "Snapchat story download process")
-        return False
+        return []
+    
+    for result in results:
+        if result.ok:
+            snapchat_logger.info(f"SNAPCHAT-DL RESULT: {result.username} -> {result.status} ({len(result.files)} files, {result.bytes} bytes)")
+        else:
+            snapchat_logger.error(f"SNAPCHAT-DL RESULT: {result.username} -> {result.status}: {result.error}")
+    
+    # Housekeeping errors must not throw away the results the scheduler relies on
+    try:
+        for endpoint, stats in rate_limiter.stats().items():
+            snapchat_logger.info(
+                f"RATE LIMIT STATS: {endpoint} - {stats['requests']} requests, {stats['throttled']} throttled, "
+                f"{stats['waited_seconds']}s waited, blocked for {stats['blocked_for']}s"
+            )
+    except Exception as e:
+        log_error_with_context(snapchat_logger, e, "Logging rate limit stats")
+    
+    try:
+        # Forget snaps whose stories have expired
+        snap_index.prune()
+    except Exception as e:
+        log_error_with_context(snapchat_logger, e, "Pruning snap index")
+    
+    failed = [r.username for r in results if not r.ok]
+    if not failed:
+        snapchat_logger.info("SNAPCHAT-DL SUCCESS: Story download completed")
+        log_function_exit(snapchat_logger, "download_snapchat_stories", "success")
+    else:
+        snapchat_logger.error(f"SNAPCHAT-DL FAILED: {len(failed)} users failed: {failed}")
+        log_function_exit(snapchat_logger, "download_snapchat_stories", "failed")
+    return results
 
 if __name__ == "__main__":
     try:
@@ -97,19 +124,38 @@ if __name__ == "__main__":
             snapchat_logger.error("SNAPCHAT-DL ERROR: No valid usernames found")
             exit(1)
             
-        # Continuous download loop
+        scheduler = PollScheduler(tracked_usernames(), requests_per_minute=REQUESTS_PER_MINUTE)
+        snapchat_logger.info(f"SNAPCHAT-DL: Scheduling {len(scheduler.users)} users at {REQUESTS_PER_MINUTE} requests/min")
+            
+        # Continuous scheduling loop
         while True:
             try:
-                success = download_snapchat_stories()
-                if success:
-                    snapchat_logger.info("SNAPCHAT-DL: Download cycle completed, waiting 30 minutes...")
-                else:
-                    snapchat_logger.warning("SNAPCHAT-DL: Download failed, retrying in 10 minutes...")
-                    time.sleep(600)  # Wait 10 minutes on failure
-                    continue
+                scheduler.sync(tracked_usernames())
+                batch = scheduler.due()
+                if batch:
+                    results = download_snapchat_stories(batch)
+                    polled = set()
+                    for result in results:
+                        polled.add(result.username)
+                        # Each user keeps its own retry and circuit-breaker state; only
+                        # not_found, parse_error and error open a user's circuit
+                        scheduler.record(result.username, result.timestamps,
+                                         failed=not result.ok and not result.transient,
+                                         throttled=result.transient)
+                    for username in batch:
+                        if username not in polled:
+                            # No result means the pass itself failed, not this user: retry, don't count it
+                            scheduler.record(username, throttled=True)
+                    scheduler.save_state()
+                    
+                    quarantined = scheduler.quarantined()
+                    if quarantined:
+                        snapchat_logger.warning(f"SNAPCHAT-DL: Quarantined users: {quarantined}")
                     
-                # Wait 30 minutes before next download
-                time.sleep(1800)
+                # Sleep until the next user is due
+                wait = min(scheduler.next_wakeup(), MAX_IDLE_SLEEP)
+                snapchat_logger.debug(f"SNAPCHAT-DL: Next check in {wait:.0f} seconds")
+                time.sleep(wait)
                 
             except KeyboardInterrupt:
                 snapchat_logger.info("SNAPCHAT-DL: Stopped by user (Ctrl+C)")
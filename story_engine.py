@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+In-process story engine for snap-tracker
+Drives the patched SnapchatDL class on asyncio so many profiles are fetched
+concurrently instead of shelling out to the snapchat-dl CLI every cycle
+"""
+
+import os
+import time
+import asyncio
+import concurrent.futures
+from dataclasses import dataclass, field
+
+import requests
+
+from snapchat_dl.snapchat_dl import ProfileUnchanged, SnapchatDL, ThrottledError
+from snapchat_dl.utils import APIResponseError, NoStoriesFound, UserNotFoundError, valid_username
+from event_stream import USER_STARTED, FILE_COMPLETED, USER_FAILED, USER_FINISHED
+from logger_config import snapchat_logger, log_error_with_context, log_function_entry, log_function_exit
+
+# Default number of profiles fetched at the same time
+DEFAULT_CONCURRENCY = 8
+
+# Per-user outcome codes
+STATUS_OK = 'ok'
+STATUS_PARTIAL = 'partial'
+STATUS_UNCHANGED = 'unchanged'
+STATUS_NO_STORIES = 'no_stories'
+STATUS_NOT_FOUND = 'not_found'
+STATUS_PARSE_ERROR = 'parse_error'
+STATUS_THROTTLED = 'throttled'
+STATUS_NETWORK_ERROR = 'network_error'
+STATUS_ERROR = 'error'
+
+# Outcomes that say nothing bad about the user itself
+SUCCESS_STATUSES = (STATUS_OK, STATUS_UNCHANGED, STATUS_NO_STORIES)
+
+# Outcomes caused by Snapchat or the network, retried without counting against the user
+TRANSIENT_STATUSES = (STATUS_THROTTLED, STATUS_NETWORK_ERROR, STATUS_PARTIAL)
+
+
+@dataclass
+class UserResult:
+    """Outcome of one username in a download cycle"""
+    username: str
+    status: str
+    stories: int = 0
+    files: list = field(default_factory=list)
+    timestamps: list = field(default_factory=list)
+    downloads: list = field(default_factory=list)
+    error: str = None
+    duration: float = 0.0
+
+    @property
+    def ok(self):
+        """True if the user was polled successfully and all its media downloaded"""
+        return self.status in SUCCESS_STATUSES
+
+    @property
+    def throttled(self):
+        return self.status == STATUS_THROTTLED
+
+    @property
+    def transient(self):
+        return self.status in TRANSIENT_STATUSES
+
+    @property
+    def bytes(self):
+        return sum(record.bytes for record in self.downloads)
+
+    @property
+    def failed_files(self):
+        return [record for record in self.downloads if not record.ok]
+
+
+def scan_prefix_usernames(directory_prefix):
+    """Return usernames taken from the directory names under the download prefix"""
+    usernames = []
+    try:
+        for entry in os.scandir(directory_prefix):
+            if entry.is_dir() and not entry.name.startswith('.') and valid_username(entry.name):
+                usernames.append(entry.name)
+    except FileNotFoundError:
+        pass
+    return sorted(usernames)
+
+
+class StoryEngine:
+    """Fetch and download stories for many usernames under a concurrency cap."""
+
+    def __init__(self, directory_prefix, concurrency=DEFAULT_CONCURRENCY, max_workers=8,
+                 per_host_workers=4, queue_size=64, sleep_interval=1, dump_json=False,
+                 snap_index=None, rate_limiter=None, download_highlights=False,
+                 media_store=None, metadata_store=None, event_publisher=None):
+        self.concurrency = max(1, int(concurrency))
+        self.media_store = media_store
+        self.event_publisher = event_publisher
+        self.downloader = SnapchatDL(
+            directory_prefix=directory_prefix,
+            max_workers=max_workers,
+            sleep_interval=sleep_interval,
+            quiet=True,
+            dump_json=dump_json,
+            # Enough keep-alive connections for every profile fetch or media worker
+            pool_maxsize=max(self.concurrency, int(max_workers)),
+            snap_index=snap_index,
+            per_host_workers=per_host_workers,
+            queue_size=queue_size,
+            rate_limiter=rate_limiter,
+            download_highlights=download_highlights,
+            metadata_store=metadata_store,
+            event_sink=self._publish if event_publisher is not None else None,
+        )
+        # Blocking fetches run here; sized so the semaphore is the only limit
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix='story-engine'
+        )
+
+    def _download_user(self, username):
+        """Blocking profile fetch of one user; returns a UserResult and its download futures"""
+        futures = []
+        try:
+            futures = self.downloader.download(username) or []
+            result = UserResult(username, STATUS_OK, stories=len(futures))
+        except ProfileUnchanged:
+            result = UserResult(username, STATUS_UNCHANGED)
+        except NoStoriesFound:
+            result = UserResult(username, STATUS_NO_STORIES)
+        except UserNotFoundError:
+            result = UserResult(username, STATUS_NOT_FOUND, error='User not found')
+        except ThrottledError:
+            result = UserResult(username, STATUS_THROTTLED, error='Throttled by Snapchat (429)')
+        except APIResponseError:
+            result = UserResult(username, STATUS_PARSE_ERROR, error='Could not parse profile page')
+        except requests.exceptions.RequestException as e:
+            result = UserResult(username, STATUS_NETWORK_ERROR, error=f"{type(e).__name__}: {e}")
+        except Exception as e:
+            log_error_with_context(snapchat_logger, e, f"Story download for {username}")
+            result = UserResult(username, STATUS_ERROR, error=f"{type(e).__name__}: {e}")
+        result.timestamps = self.downloader.story_timestamps.pop(username, [])
+        return result, futures
+
+    def _publish(self, event, **fields):
+        """Forward an event to subscribers; never lets a publishing error fail a download"""
+        if self.event_publisher is None:
+            return
+        try:
+            self.event_publisher.publish(event, **fields)
+        except Exception as e:
+            log_error_with_context(snapchat_logger, e, f"Publishing {event} event")
+
+    def _ingest(self, paths):
+        """Move finished downloads into the content-addressed store"""
+        deduplicated = sum(1 for path in paths if self.media_store.ingest(path)[1])
+        if deduplicated:
+            snapchat_logger.info(f"STORY ENGINE: {deduplicated}/{len(paths)} files were duplicates of stored media")
+
+    async def fetch_user(self, username, semaphore):
+        """Fetch one user under the concurrency cap, then wait for its media downloads"""
+        started = time.monotonic()
+        async with semaphore:
+            snapchat_logger.debug(f"STORY ENGINE: Fetching {username}")
+            self._publish(USER_STARTED, username=username)
+            loop = asyncio.get_running_loop()
+            result, futures = await loop.run_in_executor(self._executor, self._download_user, username)
+
+        # Media completes on the shared download pool; the fetch slot is already free
+        if futures:
+            result.downloads = list(await asyncio.gather(*(asyncio.wrap_future(f) for f in futures)))
+            result.files = [record.dest for record in result.downloads if record.ok]
+            if self.media_store is not None:
+                # Linked records (0 bytes) already share an inode with a stored file
+                fresh = [record.dest for record in result.downloads if record.ok and record.bytes]
+                if fresh:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(self._executor, self._ingest, fresh)
+            if result.failed_files:
+                result.status = STATUS_PARTIAL
+                result.error = f"{len(result.failed_files)}/{len(result.downloads)} downloads failed"
+                for record in result.failed_files:
+                    snapchat_logger.error(f"STORY ENGINE: {username} download failed: {record.dest}: {record.error}")
+
+        for record in result.downloads:
+            if record.ok:
+                size = os.path.getsize(record.dest) if os.path.exists(record.dest) else 0
+                self._publish(FILE_COMPLETED, username=username, path=record.dest, size=size,
+                              bytes=record.bytes, duration=round(record.duration, 3))
+
+        result.duration = time.monotonic() - started
+        if result.ok:
+            self._publish(USER_FINISHED, username=username, status=result.status,
+                          files=len(result.files), duration=round(result.duration, 3))
+        else:
+            self._publish(USER_FAILED, username=username, status=result.status, error=result.error,
+                          transient=result.transient)
+        snapchat_logger.info(
+            f"STORY ENGINE: {username} -> {result.status} "
+            f"({result.stories} stories, {len(result.files)} files, "
+            f"{result.bytes / (1024*1024):.2f} MB, {result.duration:.2f}s)"
+        )
+        return result
+
+    async def run_cycle(self, usernames):
+        """Download all usernames concurrently and return their results in input order"""
+        log_function_entry(snapchat_logger, "run_cycle", users=len(usernames), concurrency=self.concurrency)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self.fetch_user(u, semaphore) for u in usernames))
+
+        downloads = [record for result in results for record in result.downloads]
+        failed = [record for record in downloads if not record.ok]
+        total_bytes = sum(record.bytes for record in downloads)
+        busy = sum(record.duration for record in downloads)
+        snapchat_logger.info(
+            f"STORY ENGINE: Cycle downloaded {len(downloads) - len(failed)}/{len(downloads)} files, "
+            f"{total_bytes / (1024*1024):.2f} MB in {busy:.1f}s of download time, {len(failed)} failed"
+        )
+        log_function_exit(snapchat_logger, "run_cycle", f"{len(results)} results")
+        return list(results)
+
+    def run(self, usernames):
+        """Synchronous entry point for one download cycle"""
+        return asyncio.run(self.run_cycle(usernames))
+
+    def close(self):
+        """Release the engine's worker threads, download pool and pooled connections"""
+        self._executor.shutdown(wait=False)
+        self.downloader.close()
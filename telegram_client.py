@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Pooled Telegram Bot API client for snap-tracker
+One keep-alive connection pool per process, multipart bodies streamed from
+disk in fixed-size chunks (memory stays flat regardless of file size),
+automatic splitting of files over the upload limit into numbered parts and
+upload throughput reporting
+"""
+
+import os
+import time
+import uuid
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from logger_config import system_logger
+
+# Bot API upload limit for bots using api.telegram.org
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Split size leaves room for the multipart envelope and form fields
+SPLIT_PART_BYTES = MAX_UPLOAD_BYTES - 1024 * 1024
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+class MultipartStream:
+    """multipart/form-data body read lazily from disk.
+
+    Files are given as (field, filename, path, offset, length) so a byte range
+    of a large file can be uploaded without copying it.
+    """
+
+    def __init__(self, fields, files):
+        self.boundary = uuid.uuid4().hex
+        self._pieces = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            self._pieces.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode('utf-8')
+                + str(value).encode('utf-8') + b'\r\n'
+            )
+        for field, filename, path, offset, length in files:
+            safe_name = filename.replace('"', '_')
+            self._pieces.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{safe_name}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8')
+            )
+            self._pieces.append((path, offset, length))
+            self._pieces.append(b'\r\n')
+        self._pieces.append(f'--{self.boundary}--\r\n'.encode('utf-8'))
+        self.length = sum(len(p) if isinstance(p, bytes) else p[2] for p in self._pieces)
+        self.sent = 0
+        self._index = 0
+        self._buffer = b''
+        self._file = None
+        self._remaining = 0
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.length
+
+    def _next_chunk(self, size):
+        while self._index < len(self._pieces):
+            piece = self._pieces[self._index]
+            if isinstance(piece, bytes):
+                self._index += 1
+                return piece
+            path, offset, length = piece
+            if self._file is None:
+                self._file = open(path, 'rb')
+                self._file.seek(offset)
+                self._remaining = length
+            if self._remaining > 0:
+                data = self._file.read(min(size, self._remaining))
+                if not data:
+                    raise IOError(f"{path} shrank while uploading")
+                self._remaining -= len(data)
+                return data
+            self._file.close()
+            self._file = None
+            self._index += 1
+        return b''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = STREAM_CHUNK_SIZE
+        while len(self._buffer) < size:
+            chunk = self._next_chunk(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.sent += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(STREAM_CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class TelegramClient:
+    """Thread-safe Bot API client sharing one connection pool."""
+
+    def __init__(self, token, api_base='https://api.telegram.org', pool_maxsize=4):
+        self.token = token
+        self.api_base = api_base.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        # Throughput counters
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+
+    def url(self, method):
+        return f"{self.api_base}/bot{self.token}/{method}"
+
+    def call(self, method, data=None, timeout=30):
+        """Plain form POST (sendMessage, ...); returns the requests.Response"""
+        return self.session.post(self.url(method), data=data, timeout=timeout)
+
+    def upload(self, method, fields, files, timeout=300):
+        """Stream a multipart upload from disk
+
+        :param files: list of (field, filename, path, offset, length)
+        :return: the requests.Response
+        """
+        body = MultipartStream(fields, files)
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                self.url(method), data=body, timeout=timeout,
+                headers={'Content-Type': body.content_type, 'Content-Length': str(len(body))}
+            )
+        finally:
+            body.close()
+        elapsed = max(time.monotonic() - started, 1e-6)
+        with self._lock:
+            self.uploads += 1
+            self.uploaded_bytes += body.sent
+            self.upload_seconds += elapsed
+        system_logger.info(
+            f"TELEGRAM UPLOAD: {method} {body.sent / (1024*1024):.2f} MB in {elapsed:.1f}s "
+            f"({body.sent / (1024*1024) / elapsed:.2f} MB/s)"
+        )
+        return response
+
+    def send_document(self, chat_id, path, caption=None, timeout=300):
+        """Upload a file as a document, split into numbered parts if it is over the limit
+
+        Parts are named <file>.001, <file>.002, ...; join them with
+        `cat <file>.0* > <file>`.
+
+        :return: list of (part filename, response) in send order
+        """
+        size = os.path.getsize(path)
+        name = os.path.basename(path)
+        if size <= MAX_UPLOAD_BYTES:
+            response = self.upload('sendDocument', {'chat_id': chat_id, 'caption': caption},
+                                   [('document', name, path, 0, size)], timeout=timeout)
+            return [(name, response)]
+
+        total = (size + SPLIT_PART_BYTES - 1) // SPLIT_PART_BYTES
+        system_logger.info(f"TELEGRAM UPLOAD: {name} is {size / (1024*1024):.2f} MB, sending as {total} parts")
+        results = []
+        for index in range(total):
+            offset = index * SPLIT_PART_BYTES
+            length = min(SPLIT_PART_BYTES, size - offset)
+            part_name = f"{name}.{index + 1:03d}"
+            part_caption = f"{caption + chr(10) if caption else ''}Part {index + 1}/{total} of {name}"
+            if index + 1 == total:
+                part_caption += f"\nJoin with: cat {name}.0* > {name}"
+            response = self.upload('sendDocument', {'chat_id': chat_id, 'caption': part_caption},
+                                   [('document', part_name, path, offset, length)], timeout=timeout)
+            results.append((part_name, response))
+            if response.status_code != 200:
+                break  # Later parts are useless without this one
+        return results
+
+    def stats(self):
+        """Upload counters for monitoring"""
+        with self._lock:
+            return {
+                'uploads': self.uploads,
+                'uploaded_mb': round(self.uploaded_bytes / (1024 * 1024), 2),
+                'average_mb_per_s': round(self.uploaded_bytes / (1024 * 1024) / self.upload_seconds, 2)
+                if self.upload_seconds else 0.0,
+            }
@@ -1,30 +1,79 @@
 # telegram_helper.py
 
 import os
+import json
+import time
 import requests
-import os
+import threading
 from dotenv import load_dotenv
+from telegram_outbox import Outbox, DeliveryResult
+from telegram_client import TelegramClient, MAX_UPLOAD_BYTES
 from logger_config import system_logger, log_error_with_context, log_function_entry, log_function_exit
 
 # Load environment variables
 load_dotenv()
 
-def send_telegram_message(message):
-    """Send a message to the Telegram bot."""
-    log_function_entry(system_logger, "send_telegram_message", msg_length=len(message))
-    
-    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-    chat_id = os.getenv('TELEGRAM_CHAT_ID')
+# Point at a local stand-in for the Bot API (tests, self-hosted bot API server)
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+
+# Bot API upload limits (MAX_UPLOAD_BYTES comes from telegram_client)
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+MEDIA_GROUP_MAX_ITEMS = 10
+MAX_CAPTION_LENGTH = 1024
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+_outbox = None
+_outbox_lock = threading.Lock()
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return this process's pooled Bot API client, or None without a bot token."""
+    global _client
+    with _client_lock:
+        bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+        if not bot_token:
+            return None
+        if _client is None or _client.token != bot_token:
+            _client = TelegramClient(bot_token, TELEGRAM_API_BASE)
+        return _client
+
+def get_outbox():
+    """Return this process's outbox, starting its sender on first use."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(post_telegram_message).start()
+            pending = len(_outbox)
+            if pending:
+                system_logger.info(f"TELEGRAM OUTBOX: {pending} queued messages from a previous run")
+        return _outbox
+
+def flush_outbox(timeout=30.0):
+    """Deliver queued messages before the process exits; True if nothing is left."""
+    with _outbox_lock:
+        outbox = _outbox
+    if outbox is None:
+        return True
+    system_logger.info(f"TELEGRAM OUTBOX: Flushing {len(outbox)} queued messages before exit")
+    delivered = outbox.flush(timeout=timeout)
+    if not delivered:
+        system_logger.warning(f"TELEGRAM OUTBOX: {len(outbox)} messages left for the next run")
+    return delivered
+
+def post_telegram_message(chat_id, message):
+    """Deliver one message to Telegram right now; used by the outbox sender."""
+    log_function_entry(system_logger, "post_telegram_message", msg_length=len(message))
     
-    if not bot_token or not chat_id:
-        system_logger.error("TELEGRAM ERROR: Bot token or chat ID not found in environment")
-        system_logger.error(f"Bot token exists: {bool(bot_token)}")
-        system_logger.error(f"Chat ID exists: {bool(chat_id)}")
-        return False
+    client = get_client()
+    if client is None:
+        system_logger.error("TELEGRAM ERROR: Bot token not found in environment")
+        return DeliveryResult(False, error="missing bot token")
     
     system_logger.info(f"TELEGRAM: Sending message ({len(message)} chars) to chat {chat_id}")
     
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     payload = {
         'chat_id': chat_id,
         'text': message,
@@ -32,37 +81,67 @@ def send_telegram_message(message):
     }
     
     try:
-        system_logger.debug(f"TELEGRAM API: POST to {url}")
-        response = requests.post(url, data=payload, timeout=30)
+        system_logger.debug("TELEGRAM API: POST sendMessage")
+        response = client.call('sendMessage', data=payload, timeout=30)
         
         if response.status_code == 200:
             system_logger.info("TELEGRAM SUCCESS: Message sent successfully")
-            log_function_exit(system_logger, "send_telegram_message", "success")
-            return True
-        else:
-            system_logger.error(f"TELEGRAM FAILED: Status {response.status_code}")
-            system_logger.error(f"Response: {response.text}")
-            log_function_exit(system_logger, "send_telegram_message", "failed")
-            return False
+            log_function_exit(system_logger, "post_telegram_message", "success")
+            return DeliveryResult(True)
+        
+        system_logger.error(f"TELEGRAM FAILED: Status {response.status_code}")
+        system_logger.error(f"Response: {response.text}")
+        log_function_exit(system_logger, "post_telegram_message", "failed")
+        retry_after = None
+        if response.status_code == 429:
+            try:
+                retry_after = response.json().get('parameters', {}).get('retry_after')
+            except ValueError:
+                pass
+            retry_after = retry_after if retry_after is not None else response.headers.get('Retry-After', 30)
+        # Malformed message or bot blocked/kicked: retrying will not help
+        permanent = response.status_code in (400, 403)
+        return DeliveryResult(False, retry_after=retry_after, permanent=permanent,
+                              error=f"HTTP {response.status_code}")
             
     except requests.exceptions.Timeout:
         system_logger.error("TELEGRAM ERROR: Request timeout (30s)")
-        return False
+        return DeliveryResult(False, error="timeout")
     except requests.exceptions.ConnectionError:
         system_logger.error("TELEGRAM ERROR: Connection error - check internet")
-        return False
+        return DeliveryResult(False, error="connection error")
     except Exception as e:
         log_error_with_context(system_logger, e, "Telegram message sending")
+        return DeliveryResult(False, error=str(e))
+
+def send_telegram_message(message, coalesce_key=None):
+    """Queue a message for the Telegram bot; delivery happens in the background.
+    
+    :param coalesce_key: messages sharing a key within the coalesce window are sent as one digest
+    :return: True once the message is durably queued
+    """
+    log_function_entry(system_logger, "send_telegram_message", msg_length=len(message))
+    
+    chat_id = os.getenv('TELEGRAM_CHAT_ID')
+    if not chat_id:
+        system_logger.error("TELEGRAM ERROR: Chat ID not found in environment")
+        return False
+    
+    try:
+        get_outbox().enqueue(chat_id, message, coalesce_key=coalesce_key)
+        return True
+    except Exception as e:
+        log_error_with_context(system_logger, e, "Queueing Telegram message")
         return False
 
-def send_telegram_file(file_path):
-    """Send a file to the Telegram bot."""
+def send_telegram_file(file_path, caption=None):
+    """Send a file to the Telegram bot, in numbered parts if it is over the upload limit."""
     log_function_entry(system_logger, "send_telegram_file", file=file_path)
     
-    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+    client = get_client()
     chat_id = os.getenv('TELEGRAM_CHAT_ID')
     
-    if not bot_token or not chat_id:
+    if client is None or not chat_id:
         system_logger.error("TELEGRAM FILE ERROR: Bot token or chat ID not found")
         return False
     
@@ -73,26 +152,141 @@ def send_telegram_file(file_path):
     file_size = os.path.getsize(file_path)
     system_logger.info(f"TELEGRAM FILE: Sending {file_path} ({file_size / (1024*1024):.2f} MB)")
     
-    url = f"https://api.telegram.org/bot{bot_token}/sendDocument"
-    
     try:
-        with open(file_path, 'rb') as file:
-            files = {'document': file}
-            data = {'chat_id': chat_id}
-            response = requests.post(url, files=files, data=data, timeout=120)  # 2 min timeout for files
+        results = client.send_document(chat_id, file_path, caption=caption)
+        failed = [(name, response) for name, response in results if response.status_code != 200]
         
-        if response.status_code == 200:
-            system_logger.info(f"TELEGRAM FILE SUCCESS: {file_path} sent")
+        if not failed:
+            system_logger.info(f"TELEGRAM FILE SUCCESS: {file_path} sent ({len(results)} part(s))")
             log_function_exit(system_logger, "send_telegram_file", "success")
             return True
         else:
-            system_logger.error(f"TELEGRAM FILE FAILED: Status {response.status_code}")
+            name, response = failed[0]
+            system_logger.error(f"TELEGRAM FILE FAILED: {name}: Status {response.status_code}")
             system_logger.error(f"Response: {response.text}")
             return False
             
     except requests.exceptions.Timeout:
-        system_logger.error("TELEGRAM FILE ERROR: Upload timeout (2min)")
+        system_logger.error("TELEGRAM FILE ERROR: Upload timeout")
         return False
     except Exception as e:
         log_error_with_context(system_logger, e, f"Telegram file sending: {file_path}")
         return False
+
+def media_kind(file_path):
+    """'photo' or 'video' for files that can go into an album, else None"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in PHOTO_EXTENSIONS:
+        return 'photo'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    return None
+
+def plan_media_groups(file_paths):
+    """Split media into albums of up to 10 items that fit one upload request.
+    
+    :return: (list of albums, each a list of (path, kind, size); list of skipped paths)
+    """
+    groups = []
+    skipped = []
+    current = []
+    current_size = 0
+    for file_path in file_paths:
+        kind = media_kind(file_path)
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            skipped.append(file_path)
+            continue
+        limit = MAX_PHOTO_BYTES if kind == 'photo' else MAX_UPLOAD_BYTES
+        if kind is None or size > limit:
+            skipped.append(file_path)
+            continue
+        if current and (len(current) >= MEDIA_GROUP_MAX_ITEMS or current_size + size > MAX_UPLOAD_BYTES):
+            groups.append(current)
+            current, current_size = [], 0
+        current.append((file_path, kind, size))
+        current_size += size
+    if current:
+        groups.append(current)
+    return groups, skipped
+
+def _post_media_group(client, chat_id, group, captions, max_attempts=3):
+    """Upload one album (or a single photo/video), retrying after 429s."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            if len(group) == 1:
+                # sendMediaGroup needs at least two items
+                file_path, kind, size = group[0]
+                method = 'sendPhoto' if kind == 'photo' else 'sendVideo'
+                fields = {'chat_id': chat_id}
+                if captions.get(file_path):
+                    fields['caption'] = captions[file_path][:MAX_CAPTION_LENGTH]
+                files = [(kind, os.path.basename(file_path), file_path, 0, size)]
+            else:
+                method = 'sendMediaGroup'
+                media = []
+                files = []
+                for index, (file_path, kind, size) in enumerate(group):
+                    name = f"file{index}"
+                    files.append((name, os.path.basename(file_path), file_path, 0, size))
+                    item = {'type': kind, 'media': f"attach://{name}"}
+                    if captions.get(file_path):
+                        item['caption'] = captions[file_path][:MAX_CAPTION_LENGTH]
+                    media.append(item)
+                fields = {'chat_id': chat_id, 'media': json.dumps(media)}
+            
+            response = client.upload(method, fields, files, timeout=300)
+        except (requests.exceptions.RequestException, OSError) as e:
+            system_logger.error(f"TELEGRAM MEDIA ERROR: {e} (attempt {attempt}/{max_attempts})")
+            time.sleep(5 * attempt)
+            continue
+        
+        if response.status_code == 200:
+            return True
+        if response.status_code == 429:
+            try:
+                retry_after = response.json().get('parameters', {}).get('retry_after', 30)
+            except ValueError:
+                retry_after = 30
+            system_logger.warning(f"TELEGRAM MEDIA: 429, retrying album in {retry_after}s")
+            time.sleep(float(retry_after))
+            continue
+        system_logger.error(f"TELEGRAM MEDIA FAILED: Status {response.status_code}")
+        system_logger.error(f"Response: {response.text}")
+        return False
+    return False
+
+def send_telegram_media(file_paths, captions=None):
+    """Send photos and videos as albums of up to 10 (sendMediaGroup).
+    
+    :param captions: optional {path: caption}
+    :return: (files sent, files skipped or failed)
+    """
+    log_function_entry(system_logger, "send_telegram_media", files=len(file_paths))
+    
+    client = get_client()
+    chat_id = os.getenv('TELEGRAM_CHAT_ID')
+    if client is None or not chat_id:
+        system_logger.error("TELEGRAM MEDIA ERROR: Bot token or chat ID not found")
+        return 0, len(file_paths)
+    
+    groups, skipped = plan_media_groups(file_paths)
+    for file_path in skipped:
+        system_logger.warning(f"TELEGRAM MEDIA: Not sending {file_path} (not a photo/video or over the upload limit)")
+    
+    sent = 0
+    failed = len(skipped)
+    for index, group in enumerate(groups, 1):
+        size = sum(item[2] for item in group)
+        system_logger.info(
+            f"TELEGRAM MEDIA: Album {index}/{len(groups)}: {len(group)} items, {size / (1024*1024):.2f} MB"
+        )
+        if _post_media_group(client, chat_id, group, captions or {}):
+            sent += len(group)
+        else:
+            failed += len(group)
+    
+    log_function_exit(system_logger, "send_telegram_media", f"{sent} sent, {failed} not sent")
+    system_logger.info(f"TELEGRAM UPLOAD STATS: {client.stats()}")
+    return sent, failed
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Persistent Telegram outbox for snap-tracker
+Messages are written to a SQLite table first and delivered by a background
+sender, so a Telegram outage or a 429 delays alerts instead of losing them.
+The sender honors retry_after, keeps each chat under Telegram's rate limits
+and folds bursts of related messages into one digest
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from collections import deque
+from dotenv import load_dotenv
+from logger_config import system_logger, log_error_with_context
+
+# Load environment variables
+load_dotenv()
+
+# Kept outside logs/ so log retention never drops queued alerts
+TELEGRAM_OUTBOX_DB = os.getenv('TELEGRAM_OUTBOX_DB', 'data/telegram_outbox.db')
+
+# Messages with the same coalesce key arriving within this window become one digest
+COALESCE_WINDOW = float(os.getenv('TELEGRAM_COALESCE_WINDOW', '30'))
+
+# Telegram allows about 1 message per second per chat and 20 per minute in groups
+CHAT_MIN_INTERVAL = 1.0
+CHAT_PER_MINUTE = 20
+
+MAX_MESSAGE_LENGTH = 4096
+DIGEST_SEPARATOR = '\n\n──────────\n\n'
+
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 15 * 60.0
+MAX_ATTEMPTS = 20
+
+# A claimed message is offered again if its sender died mid-delivery
+CLAIM_LEASE = 120.0
+
+
+class DeliveryResult:
+    """Outcome of one send attempt, as reported by the transport."""
+
+    def __init__(self, ok, retry_after=None, permanent=False, error=None):
+        self.ok = ok
+        self.retry_after = retry_after
+        self.permanent = permanent
+        self.error = error
+
+
+class Outbox:
+    """SQLite-backed message queue drained by one sender thread."""
+
+    def __init__(self, transport, path=TELEGRAM_OUTBOX_DB, coalesce_window=COALESCE_WINDOW):
+        """
+        :param transport: callable(chat_id, text) -> DeliveryResult
+        """
+        self.transport = transport
+        self.path = path
+        self.coalesce_window = coalesce_window
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' chat_id TEXT NOT NULL,'
+            ' text TEXT NOT NULL,'
+            ' coalesce_key TEXT,'
+            ' created_at REAL NOT NULL,'
+            ' next_attempt REAL NOT NULL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0'
+            ')'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt)')
+        # Send times per chat over the last minute
+        self._sent = {}
+        self._blocked_until = {}
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def enqueue(self, chat_id, text, coalesce_key=None):
+        """Durably queue a message; returns its outbox id"""
+        now = time.time()
+        # Coalescible messages wait out the window so a burst can be folded together
+        due = now + self.coalesce_window if coalesce_key else now
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO outbox (chat_id, text, coalesce_key, created_at, next_attempt) VALUES (?, ?, ?, ?, ?)',
+                (str(chat_id), text, coalesce_key, now, due)
+            )
+        self._wake.set()
+        system_logger.debug(f"TELEGRAM OUTBOX: Queued message #{cursor.lastrowid} for chat {chat_id}")
+        return cursor.lastrowid
+
+    def start(self):
+        """Start the background sender (idempotent)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='telegram-outbox', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                delay = self.drain_once()
+            except Exception as e:
+                log_error_with_context(system_logger, e, "Draining Telegram outbox")
+                delay = BACKOFF_BASE
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _chat_wait(self, chat_id, now):
+        """Seconds until this chat may receive another message"""
+        wait = max(0.0, self._blocked_until.get(chat_id, 0.0) - now)
+        sent = self._sent.setdefault(chat_id, deque())
+        while sent and sent[0] <= now - 60:
+            sent.popleft()
+        if sent:
+            wait = max(wait, sent[-1] + CHAT_MIN_INTERVAL - now)
+        if len(sent) >= CHAT_PER_MINUTE:
+            wait = max(wait, sent[0] + 60 - now)
+        return wait
+
+    def _claim(self, now):
+        """Pick the next deliverable message and everything that coalesces with it
+
+        :return: (rows, seconds until the next message is due)
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                candidates = self._conn.execute(
+                    'SELECT id, chat_id, text, coalesce_key, attempts, next_attempt, created_at FROM outbox ORDER BY id'
+                ).fetchall()
+                next_due = None
+                for row in candidates:
+                    chat_id, next_attempt = row[1], row[5]
+                    ready_at = max(next_attempt, now + self._chat_wait(chat_id, now))
+                    if ready_at > now:
+                        next_due = ready_at if next_due is None else min(next_due, ready_at)
+                        continue
+                    rows = [row]
+                    if row[3]:
+                        # Fold in rows that are due or still in their first coalesce window;
+                        # rows backing off after a failed attempt (or leased) keep their turn
+                        rows += [
+                            other for other in candidates
+                            if other[0] != row[0] and other[1] == chat_id and other[3] == row[3]
+                            and (other[5] <= now
+                                 or (other[4] == 0 and other[5] <= other[6] + self.coalesce_window))
+                        ]
+                    self._conn.executemany(
+                        'UPDATE outbox SET next_attempt = ? WHERE id = ?',
+                        [(now + CLAIM_LEASE, r[0]) for r in rows]
+                    )
+                    self._conn.execute('COMMIT')
+                    return rows, 0.0
+                self._conn.execute('COMMIT')
+                return [], (max(0.0, next_due - now) if next_due is not None else None)
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def _digest(rows):
+        """Join queued texts into one message within Telegram's length limit
+
+        :return: (text, rows included)
+        """
+        if len(rows) == 1:
+            return rows[0][2][:MAX_MESSAGE_LENGTH], rows
+        header = f"📬 {len(rows)} updates\n\n"
+        text = header
+        included = []
+        for row in rows:
+            chunk = row[2] if not included else DIGEST_SEPARATOR + row[2]
+            if included and len(text) + len(chunk) > MAX_MESSAGE_LENGTH:
+                break
+            text += chunk
+            included.append(row)
+        if len(included) < len(rows):
+            text = f"📬 {len(included)} updates\n\n" + text[len(header):]
+        return text[:MAX_MESSAGE_LENGTH], included
+
+    def drain_once(self):
+        """Deliver one message (or digest)
+
+        :return: seconds to wait before the next call, or None to wait for enqueue
+        """
+        now = time.time()
+        rows, wait = self._claim(now)
+        if not rows:
+            return wait
+        chat_id = rows[0][1]
+        text, included = self._digest(rows)
+        ids = [row[0] for row in included]
+        leftover = [row[0] for row in rows if row not in included]
+
+        result = self.transport(chat_id, text)
+        self._sent.setdefault(chat_id, deque()).append(time.time())
+
+        with self._lock:
+            if leftover:
+                # Did not fit into this digest; send right after
+                self._conn.execute(
+                    f"UPDATE outbox SET next_attempt = ? WHERE id IN ({','.join('?' * len(leftover))})",
+                    [now] + leftover
+                )
+            if result.ok:
+                self._conn.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids)
+                if len(ids) > 1:
+                    system_logger.info(f"TELEGRAM OUTBOX: Delivered digest of {len(ids)} messages to chat {chat_id}")
+                return 0.0
+
+            attempts = max(row[4] for row in included) + 1
+            if result.permanent or attempts >= MAX_ATTEMPTS:
+                self._conn.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids)
+                system_logger.error(
+                    f"TELEGRAM OUTBOX: Dropping {len(ids)} messages for chat {chat_id} after {attempts} attempts: "
+                    f"{result.error}"
+                )
+                return 0.0
+
+            if result.retry_after is not None:
+                delay = float(result.retry_after)
+                # Telegram throttles the whole chat, not just this message
+                self._blocked_until[chat_id] = time.time() + delay
+                system_logger.warning(f"TELEGRAM OUTBOX: 429 for chat {chat_id}, retry after {delay:.0f}s")
+            else:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempts - 1)))
+                system_logger.warning(
+                    f"TELEGRAM OUTBOX: Delivery failed ({result.error}), attempt {attempts}, retrying in {delay:.0f}s"
+                )
+            self._conn.execute(
+                f"UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id IN ({','.join('?' * len(ids))})",
+                [attempts, time.time() + delay] + ids
+            )
+            return 0.0
+
+    def flush(self, timeout=30.0):
+        """Deliver everything due, waiting up to timeout (called by the monitor before exiting)"""
+        deadline = time.time() + timeout
+        while time.time() < deadline and len(self):
+            wait = self.drain_once()
+            if wait:
+                time.sleep(min(wait, max(0.0, deadline - time.time())))
+        return len(self) == 0
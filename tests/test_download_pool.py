@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Download pool tests for snap-tracker
+Loads the patched snapchat_dl downloader from patches/modified_files and runs
+DownloadPool against a fake download_url to check the per-host and total
+concurrency caps, the bounded queue and shutdown with downloads still queued
+"""
+
+import os
+import time
+import threading
+import unittest
+import importlib.util
+from collections import Counter
+from unittest import mock
+
+PATCHED_DOWNLOADER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'patches', 'modified_files', 'downloader.py')
+
+
+def load_downloader():
+    """Import the patched downloader.py as a standalone module"""
+    spec = importlib.util.spec_from_file_location('patched_downloader', PATCHED_DOWNLOADER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+downloader = load_downloader()
+
+
+class FakeDownloads:
+    """Stand-in for download_url that blocks until released and tracks concurrency per host"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.active = Counter()
+        self.peak = Counter()
+        self.peak_total = 0
+        self.started = []
+
+    def __call__(self, url, dest, *args, **kwargs):
+        host = url.split('/')[2]
+        with self.lock:
+            self.active[host] += 1
+            self.peak[host] = max(self.peak[host], self.active[host])
+            self.peak_total = max(self.peak_total, sum(self.active.values()))
+            self.started.append(url)
+        try:
+            if not self.release.wait(5):
+                raise IOError("never released")
+            return 10
+        finally:
+            with self.lock:
+                self.active[host] -= 1
+
+    def wait_started(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.started) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+
+class DownloadPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeDownloads()
+        patch = mock.patch.object(downloader, 'download_url', self.fake)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def make_pool(self, **kwargs):
+        pool = downloader.DownloadPool(**kwargs)
+        self.addCleanup(pool.shutdown)
+        # Cleanups run last-in first-out: unblock the workers before shutdown waits for them
+        self.addCleanup(self.fake.release.set)
+        return pool
+
+    def test_per_host_and_total_caps(self):
+        pool = self.make_pool(max_workers=4, per_host=2, queue_size=32)
+        futures = [pool.submit(f"https://{host}/media{i}", f"/tmp/{host}-{i}", 0)
+                   for host in ('a.example', 'b.example', 'c.example') for i in range(4)]
+
+        self.assertTrue(self.fake.wait_started(4))
+        time.sleep(0.1)
+        with self.fake.lock:
+            self.assertEqual(len(self.fake.started), 4)
+            self.assertEqual(sum(self.fake.active.values()), 4)
+            self.assertTrue(all(count <= 2 for count in self.fake.active.values()))
+
+        self.fake.release.set()
+        records = [future.result(timeout=5) for future in futures]
+        self.assertTrue(all(record.ok and record.bytes == 10 for record in records))
+        self.assertEqual(max(self.fake.peak.values()), 2)
+        self.assertEqual(self.fake.peak_total, 4)
+
+    def test_busy_host_does_not_hold_workers(self):
+        pool = self.make_pool(max_workers=3, per_host=1, queue_size=32)
+        for i in range(5):
+            pool.submit(f"https://slow.example/media{i}", f"/tmp/slow-{i}", 0)
+        pool.submit("https://other.example/media", "/tmp/other", 0)
+
+        # The queued slow.example downloads must not keep other.example waiting
+        self.assertTrue(self.fake.wait_started(2))
+        with self.fake.lock:
+            self.assertIn("https://other.example/media", self.fake.started)
+            self.assertEqual(self.fake.active['slow.example'], 1)
+
+    def test_submit_blocks_when_queue_is_full(self):
+        pool = self.make_pool(max_workers=1, per_host=1, queue_size=2)
+        for i in range(3):
+            pool.submit(f"https://a.example/media{i}", f"/tmp/a-{i}", 0)
+
+        submitted = threading.Event()
+
+        def submit_one_more():
+            pool.submit("https://a.example/extra", "/tmp/a-extra", 0)
+            submitted.set()
+
+        threading.Thread(target=submit_one_more, daemon=True).start()
+        self.assertFalse(submitted.wait(0.2))
+
+        self.fake.release.set()
+        self.assertTrue(submitted.wait(5))
+
+    def test_shutdown_fails_queued_downloads(self):
+        pool = self.make_pool(max_workers=1, per_host=1, queue_size=3)
+        futures = [pool.submit(f"https://a.example/media{i}", f"/tmp/a-{i}", 0) for i in range(4)]
+        self.assertTrue(self.fake.wait_started(1))
+
+        done = threading.Event()
+
+        def shutdown():
+            pool.shutdown()
+            done.set()
+
+        threading.Thread(target=shutdown, daemon=True).start()
+        # Queued downloads resolve right away, the running one is waited for
+        for future in futures[1:]:
+            record = future.result(timeout=5)
+            self.assertFalse(record.ok)
+            self.assertEqual(record.error, "DownloadPool shut down")
+        self.assertFalse(done.is_set())
+
+        self.fake.release.set()
+        self.assertTrue(done.wait(5))
+        self.assertTrue(futures[0].result(timeout=5).ok)
+        self.assertEqual(len(self.fake.started), 1)
+
+        # Every queue slot was handed back and later submits fail without blocking
+        for _ in range(pool.max_workers + 3):
+            self.assertTrue(pool._slots.acquire(blocking=False))
+        for _ in range(pool.max_workers + 3):
+            pool._slots.release()
+        record = pool.submit("https://a.example/late", "/tmp/a-late", 0).result(timeout=5)
+        self.assertEqual(record.error, "DownloadPool shut down")
+
+    def test_failed_download_resolves_with_error(self):
+        pool = self.make_pool(max_workers=1)
+        with mock.patch.object(downloader, 'download_url', side_effect=IOError("boom")):
+            record = pool.submit("https://a.example/media", "/tmp/a", 0).result(timeout=5)
+        self.assertEqual(record.error, "OSError: boom")
+        self.assertIsNone(downloader.future_record(_cancelled_future()))
+
+
+def _cancelled_future():
+    future = downloader.concurrent.futures.Future()
+    future.cancel()
+    return future
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Resumable download tests for snap-tracker
+Drives the patched download_url against a scripted session to check Range
+resumes, servers that ignore or mangle ranges, 416 replies and transfers that
+end short of the announced size
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from tests.test_download_pool import downloader
+
+BODY = bytes(range(256)) * 40
+
+
+class FakeResponse:
+    """Streaming response double usable as a context manager"""
+
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+
+def full(body=BODY):
+    return FakeResponse(200, body, {'Content-Length': str(len(body))})
+
+
+def partial(start, body=BODY, total=None):
+    total = len(body) if total is None else total
+    return FakeResponse(206, body[start:], {'Content-Range': f"bytes {start}-{len(body) - 1}/{total}"})
+
+
+class FakeSession:
+    """Replays scripted responses and records the headers of every request"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.requests.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+
+class DownloadUrlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.dest = os.path.join(self.tmp, 'media.mp4')
+        self.part = self.dest + downloader.PART_SUFFIX
+        patch = mock.patch.object(downloader.time, 'sleep')
+        self.sleep = patch.start()
+        self.addCleanup(patch.stop)
+
+    def write_part(self, data):
+        with open(self.part, 'wb') as f:
+            f.write(data)
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def download(self, session, **kwargs):
+        return downloader.download_url("https://cdn.example/media", self.dest, 0, session=session, **kwargs)
+
+    def test_fresh_download(self):
+        session = FakeSession(full())
+        self.assertEqual(self.download(session), len(BODY))
+        self.assertEqual(self.read_dest(), BODY)
+        self.assertFalse(os.path.exists(self.part))
+        self.assertNotIn('Range', session.requests[0])
+
+    def test_existing_file_is_skipped(self):
+        with open(self.dest, 'wb') as f:
+            f.write(b'done')
+        session = FakeSession()
+        self.assertEqual(self.download(session), 0)
+        self.assertEqual(session.requests, [])
+
+    def test_resumes_part_file_with_range(self):
+        self.write_part(BODY[:1000])
+        session = FakeSession(partial(1000))
+        self.assertEqual(self.download(session), len(BODY) - 1000)
+        self.assertEqual(session.requests[0]['Range'], 'bytes=1000-')
+        self.assertEqual(self.read_dest(), BODY)
+
+    def test_resumes_after_interrupted_transfer(self):
+        truncated = FakeResponse(200, BODY[:3000], {'Content-Length': str(len(BODY))})
+        session = FakeSession(truncated, partial(3000))
+        self.download(session)
+        self.assertEqual(session.requests[1]['Range'], 'bytes=3000-')
+        self.assertEqual(self.read_dest(), BODY)
+        self.sleep.assert_any_call(2)
+
+    def test_full_response_to_range_request_restarts(self):
+        self.write_part(b'stale bytes that must not survive')
+        session = FakeSession(full())
+        self.assertEqual(self.download(session), len(BODY))
+        self.assertIn('Range', session.requests[0])
+        self.assertEqual(self.read_dest(), BODY)
+
+    def test_unusable_partial_response_is_discarded(self):
+        self.write_part(BODY[:1000])
+        # Server answers the range with bytes from somewhere else
+        session = FakeSession(partial(500), full())
+        self.download(session)
+        self.assertEqual(session.requests[0]['Range'], 'bytes=1000-')
+        self.assertNotIn('Range', session.requests[1])
+        self.assertEqual(self.read_dest(), BODY)
+
+    def test_partial_response_without_content_range_is_discarded(self):
+        self.write_part(BODY[:1000])
+        session = FakeSession(FakeResponse(206, BODY[1000:]), full())
+        self.download(session)
+        self.assertNotIn('Range', session.requests[1])
+        self.assertEqual(self.read_dest(), BODY)
+
+    def test_range_not_satisfiable_drops_part_file(self):
+        self.write_part(BODY + b'extra')
+        session = FakeSession(FakeResponse(416), full())
+        self.download(session)
+        self.assertEqual(session.requests[0]['Range'], f"bytes={len(BODY) + 5}-")
+        self.assertNotIn('Range', session.requests[1])
+        self.assertEqual(self.read_dest(), BODY)
+
+    def test_size_mismatch_gives_up_after_max_attempts(self):
+        short = [FakeResponse(200, BODY[:100], {'Content-Length': str(len(BODY))})]
+        short += [partial(100, BODY[:100], total=len(BODY)) for _ in range(2)]
+        with self.assertRaises(IOError):
+            self.download(FakeSession(*short), max_attempts=3)
+        self.assertFalse(os.path.exists(self.dest))
+        # The bytes received so far are kept for the next run to resume
+        self.assertEqual(os.path.getsize(self.part), 100)
+
+    def test_oversized_part_file_is_dropped(self):
+        long = FakeResponse(200, BODY + b'junk', {'Content-Length': str(len(BODY))})
+        with self.assertRaises(IOError):
+            self.download(FakeSession(long), max_attempts=1)
+        self.assertFalse(os.path.exists(self.part))
+
+    def test_http_errors_are_not_retried(self):
+        session = FakeSession(FakeResponse(404), full())
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.download(session)
+        self.assertEqual(len(session.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
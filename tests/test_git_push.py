@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Batched push tests for snap-tracker
+Checks how changed files are split into commit-sized batches and that
+unpushed commits are resumed from the last one the remote acknowledged,
+using a throwaway repository and a local bare remote
+"""
+
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+import git_commiter
+from git_commiter import CliGitBackend, plan_push_batches, push_pending_commits
+from push_tracker import PushTracker
+
+MB = 1024 * 1024
+
+GIT_IDENTITY = {
+    'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+}
+
+
+class PlanPushBatchesTest(unittest.TestCase):
+
+    def test_batches_are_capped_by_bytes(self):
+        records = {f"{i}.mp4": {'size': 20 * MB, 'mtime_ns': i} for i in range(5)}
+        batches = plan_push_batches(list(records), records, max_bytes=50 * MB, max_files=100)
+        self.assertEqual(batches, [['0.mp4', '1.mp4'], ['2.mp4', '3.mp4'], ['4.mp4']])
+
+    def test_batches_are_capped_by_file_count(self):
+        records = {f"{i}.jpg": {'size': 1, 'mtime_ns': i} for i in range(7)}
+        batches = plan_push_batches(list(records), records, max_bytes=50 * MB, max_files=3)
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+
+    def test_oversized_file_gets_its_own_batch(self):
+        records = {
+            'a.jpg': {'size': 1 * MB, 'mtime_ns': 1},
+            'huge.mp4': {'size': 80 * MB, 'mtime_ns': 2},
+            'b.jpg': {'size': 1 * MB, 'mtime_ns': 3},
+        }
+        batches = plan_push_batches(list(records), records, max_bytes=50 * MB, max_files=100)
+        self.assertEqual(batches, [['a.jpg'], ['huge.mp4'], ['b.jpg']])
+
+    def test_oldest_files_go_first(self):
+        records = {
+            'new.jpg': {'size': 1, 'mtime_ns': 30},
+            'b.jpg': {'size': 1, 'mtime_ns': 10},
+            'a.jpg': {'size': 1, 'mtime_ns': 10},
+            'unknown.jpg': {'size': 1, 'mtime_ns': None},
+        }
+        batches = plan_push_batches(list(records), records, max_bytes=50 * MB, max_files=2)
+        self.assertEqual(batches, [['unknown.jpg', 'a.jpg'], ['b.jpg', 'new.jpg']])
+
+
+class FlakyBackend(CliGitBackend):
+    """git CLI backend whose push fails for chosen commits"""
+
+    def __init__(self, repo_path):
+        super().__init__(repo_path)
+        self.failing = set()
+        self.pushed = []
+
+    def push(self, repo_url, branch, commit='HEAD', timeout=None):
+        if commit in self.failing:
+            return False, 'simulated network error'
+        self.pushed.append(commit)
+        return super().push(repo_url, branch, commit=commit, timeout=timeout)
+
+
+class PushPendingCommitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.repo = os.path.join(self.tmp, 'repo')
+        self.remote = os.path.join(self.tmp, 'remote.git')
+        subprocess.run(['git', 'init', '-q', self.repo], check=True)
+        subprocess.run(['git', 'init', '-q', '--bare', self.remote], check=True)
+
+        self.tracker = PushTracker(os.path.join(self.tmp, 'pushed_files.db'), legacy_json=None)
+        self.addCleanup(self.tracker.close)
+        patches = [
+            mock.patch.dict(os.environ, GIT_IDENTITY),
+            mock.patch.object(git_commiter, '_tracker', self.tracker),
+            mock.patch.object(git_commiter, 'PUSH_ATTEMPTS', 2),
+            mock.patch.object(git_commiter.time, 'sleep'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.backend = FlakyBackend(self.repo)
+
+    def commit_file(self, name):
+        with open(os.path.join(self.repo, name), 'w') as f:
+            f.write(name)
+        self.assertEqual(self.backend.stage([name]), (True, ''))
+        ok, error = self.backend.commit(f"add {name}")
+        self.assertTrue(ok, error)
+        return self.backend.head()
+
+    def remote_head(self):
+        result = subprocess.run(['git', '--git-dir', self.remote, 'rev-parse', '--verify', '--quiet', 'main'],
+                                capture_output=True, text=True)
+        return result.stdout.strip() or None
+
+    def acked(self):
+        return self.tracker.get_meta(git_commiter.ACKED_COMMIT_KEY.format(branch='main'))
+
+    def test_pushes_each_commit_in_order(self):
+        commits = [self.commit_file(f"{i}.jpg") for i in range(3)]
+        # Nothing acknowledged yet: only HEAD is pushed
+        self.assertTrue(push_pending_commits(self.backend, self.remote, 'main'))
+        self.assertEqual(self.backend.pushed, [commits[-1]])
+        self.assertEqual(self.acked(), commits[-1])
+
+        more = [self.commit_file(f"more{i}.jpg") for i in range(3)]
+        self.assertTrue(push_pending_commits(self.backend, self.remote, 'main'))
+        self.assertEqual(self.backend.pushed, [commits[-1]] + more)
+        self.assertEqual(self.remote_head(), more[-1])
+
+    def test_resumes_after_acked_commit(self):
+        self.commit_file('first.jpg')
+        self.assertTrue(push_pending_commits(self.backend, self.remote, 'main'))
+
+        commits = [self.commit_file(f"{i}.jpg") for i in range(3)]
+        self.backend.failing.add(commits[1])
+        self.assertFalse(push_pending_commits(self.backend, self.remote, 'main'))
+        # The commit before the failure is acknowledged, the rest stays local
+        self.assertEqual(self.acked(), commits[0])
+        self.assertEqual(self.remote_head(), commits[0])
+
+        self.backend.failing.clear()
+        self.backend.pushed.clear()
+        self.assertTrue(push_pending_commits(self.backend, self.remote, 'main'))
+        self.assertEqual(self.backend.pushed, commits[1:])
+        self.assertEqual(self.acked(), commits[2])
+        self.assertEqual(self.remote_head(), commits[2])
+
+    def test_nothing_to_push_when_caught_up(self):
+        self.commit_file('a.jpg')
+        self.assertTrue(push_pending_commits(self.backend, self.remote, 'main'))
+        self.backend.pushed.clear()
+        self.assertTrue(push_pending_commits(self.backend, self.remote, 'main'))
+        self.assertEqual(self.backend.pushed, [])
+
+    def test_unknown_acked_commit_pushes_head(self):
+        commits = [self.commit_file(f"{i}.jpg") for i in range(2)]
+        self.tracker.set_meta(git_commiter.ACKED_COMMIT_KEY.format(branch='main'), '0' * 40)
+        self.assertTrue(push_pending_commits(self.backend, self.remote, 'main'))
+        self.assertEqual(self.backend.pushed, [commits[-1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Poll scheduler tests for snap-tracker
+Covers the per-user circuit breaker: consecutive failures open it, transient
+outcomes (throttling, network errors, partial downloads) never count against
+the user, and a successful poll closes it again
+"""
+
+import unittest
+
+import poll_scheduler
+from poll_scheduler import PollScheduler
+from story_engine import UserResult
+
+NOW = 1_700_000_000.0
+
+
+def record_result(scheduler, result, now):
+    """Record a poll the way snapchat_story's scheduling loop does"""
+    scheduler.record(result.username, result.timestamps,
+                     failed=not result.ok and not result.transient,
+                     throttled=result.transient, now=now)
+
+
+class PollSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = PollScheduler(['alice', 'bob'], requests_per_minute=60, state_file=None)
+
+    def test_consecutive_failures_open_the_circuit(self):
+        schedule = self.scheduler.users['alice']
+        for attempt in range(1, poll_scheduler.FAILURE_THRESHOLD):
+            self.scheduler.record('alice', failed=True, now=NOW)
+            self.assertFalse(schedule.quarantined)
+            # Exponential retry delay before the circuit opens
+            self.assertEqual(schedule.next_due - NOW, poll_scheduler.FAILURE_INTERVAL * 2 ** (attempt - 1))
+
+        self.scheduler.record('alice', failed=True, now=NOW)
+        self.assertTrue(schedule.quarantined)
+        self.assertEqual(self.scheduler.quarantined(), ['alice'])
+        self.assertEqual(schedule.next_due - NOW, poll_scheduler.QUARANTINE_INTERVAL)
+
+        # A failed half-open probe keeps the circuit open for longer, up to the cap
+        self.scheduler.record('alice', failed=True, now=NOW)
+        self.assertEqual(schedule.next_due - NOW, 2 * poll_scheduler.QUARANTINE_INTERVAL)
+        for _ in range(10):
+            self.scheduler.record('alice', failed=True, now=NOW)
+        self.assertEqual(schedule.next_due - NOW, poll_scheduler.QUARANTINE_MAX)
+
+    def test_success_closes_the_circuit(self):
+        for _ in range(poll_scheduler.FAILURE_THRESHOLD):
+            self.scheduler.record('alice', failed=True, now=NOW)
+        self.scheduler.record('alice', timestamps=[NOW - 60], now=NOW)
+        schedule = self.scheduler.users['alice']
+        self.assertFalse(schedule.quarantined)
+        self.assertEqual((schedule.failures, schedule.quarantines), (0, 0))
+
+    def test_throttled_poll_is_retried_without_counting(self):
+        self.scheduler.record('alice', failed=True, now=NOW)
+        self.scheduler.record('alice', throttled=True, now=NOW)
+        schedule = self.scheduler.users['alice']
+        self.assertEqual(schedule.failures, 1)
+        self.assertEqual(schedule.next_due - NOW, poll_scheduler.THROTTLED_INTERVAL)
+
+    def test_transient_statuses_never_open_the_circuit(self):
+        for status in ('throttled', 'network_error', 'partial'):
+            scheduler = PollScheduler(['alice'], state_file=None)
+            for _ in range(poll_scheduler.FAILURE_THRESHOLD * 3):
+                record_result(scheduler, UserResult('alice', status), NOW)
+            self.assertEqual(scheduler.users['alice'].failures, 0, status)
+            self.assertEqual(scheduler.quarantined(), [], status)
+
+    def test_user_specific_statuses_open_the_circuit(self):
+        for status in ('not_found', 'parse_error', 'error'):
+            scheduler = PollScheduler(['alice'], state_file=None)
+            for _ in range(poll_scheduler.FAILURE_THRESHOLD):
+                record_result(scheduler, UserResult('alice', status), NOW)
+            self.assertEqual(scheduler.quarantined(), ['alice'], status)
+
+    def test_healthy_user_keeps_its_schedule(self):
+        for _ in range(poll_scheduler.FAILURE_THRESHOLD):
+            record_result(self.scheduler, UserResult('alice', 'not_found'), NOW)
+        record_result(self.scheduler, UserResult('bob', 'ok', timestamps=[NOW - 60]), NOW)
+        self.assertEqual(self.scheduler.quarantined(), ['alice'])
+        self.assertEqual(self.scheduler.users['bob'].next_due - NOW, poll_scheduler.DEFAULT_INTERVAL)
+
+    def test_due_respects_request_budget(self):
+        scheduler = PollScheduler([f"user{i}" for i in range(5)], requests_per_minute=3, state_file=None)
+        self.assertEqual(len(scheduler.due(now=NOW)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Push tracker tests for snap-tracker
+Checks the one-time import of the legacy JSON tracker into SQLite and that
+records, forgotten paths and meta values survive reopening the database
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from push_tracker import PushTracker
+
+
+class PushTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.db = os.path.join(self.tmp, 'data', 'pushed_files.db')
+        self.legacy = os.path.join(self.tmp, 'pushed_files_tracker.json')
+
+    def open_tracker(self):
+        tracker = PushTracker(self.db, self.legacy)
+        self.addCleanup(tracker.close)
+        return tracker
+
+    def write_legacy(self, data):
+        with open(self.legacy, 'w') as f:
+            json.dump(data, f)
+
+    def test_migrates_legacy_json(self):
+        self.write_legacy({
+            'alice/2024-01-01/a.jpg': {'hash': 'aa' * 16, 'size': 10, 'mtime': 1.5},
+            'alice/2024-01-01/b.mp4': {'hash': 'bb' * 16, 'size': 20, 'mtime': 2.5, 'inode': 7},
+        })
+        tracker = self.open_tracker()
+
+        self.assertEqual(len(tracker), 2)
+        self.assertEqual(tracker.paths(), {'alice/2024-01-01/a.jpg', 'alice/2024-01-01/b.mp4'})
+        self.assertEqual(tracker.get('alice/2024-01-01/a.jpg'), {
+            'hash': 'aa' * 16, 'algorithm': 'md5', 'size': 10, 'mtime': 1.5, 'mtime_ns': None, 'inode': None,
+        })
+        self.assertEqual(tracker.get('alice/2024-01-01/b.mp4')['inode'], 7)
+        self.assertIsNone(tracker.get('alice/2024-01-01/missing.jpg'))
+        # The JSON file is kept for reference but never imported twice
+        self.assertFalse(os.path.exists(self.legacy))
+        self.assertTrue(os.path.exists(self.legacy + '.migrated'))
+
+    def test_migrates_only_once(self):
+        self.write_legacy({'a.jpg': {'hash': 'old', 'size': 1}})
+        tracker = self.open_tracker()
+        tracker.record({'a.jpg': {'hash': 'new', 'algorithm': 'sha1', 'size': 1}})
+        tracker.close()
+
+        reopened = self.open_tracker()
+        self.assertEqual(reopened.get('a.jpg')['hash'], 'new')
+        self.assertEqual(reopened.get('a.jpg')['algorithm'], 'sha1')
+
+    def test_corrupt_legacy_json_is_left_alone(self):
+        with open(self.legacy, 'w') as f:
+            f.write('{not json')
+        tracker = self.open_tracker()
+        self.assertEqual(len(tracker), 0)
+        self.assertTrue(os.path.exists(self.legacy))
+
+    def test_record_forget_and_meta_persist(self):
+        tracker = self.open_tracker()
+        tracker.record({
+            'a.jpg': {'hash': 'h1', 'algorithm': 'sha1', 'size': 1, 'mtime_ns': 10, 'inode': 1},
+            'b.jpg': {'hash': 'h2', 'algorithm': 'sha1', 'size': 2, 'mtime_ns': 20, 'inode': 2},
+        })
+        tracker.record({'c.jpg': {'hash': 'h3', 'algorithm': 'sha1'}}, forget=['a.jpg'])
+        tracker.set_meta('acked_commit:main', 'abc123')
+        tracker.close()
+
+        reopened = self.open_tracker()
+        self.assertEqual(reopened.paths(), {'b.jpg', 'c.jpg'})
+        self.assertEqual(reopened.get('b.jpg')['mtime_ns'], 20)
+        self.assertEqual(reopened.get_meta('acked_commit:main'), 'abc123')
+        self.assertIsNone(reopened.get_meta('acked_commit:other'))
+
+
+if __name__ == '__main__':
+    unittest.main()
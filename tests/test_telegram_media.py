@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Album sending tests for snap-tracker
+Runs telegram_helper against a local stand-in for the Bot API (http.server)
+so album splitting, sendMediaGroup bodies, the single-item fallback and 429
+retries are checked without touching api.telegram.org
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telegram_helper
+from telegram_helper import plan_media_groups, send_telegram_media
+
+MB = 1024 * 1024
+
+
+def parse_multipart(content_type, body):
+    """Split a multipart/form-data body into ({field: value}, {field: (filename, data)})"""
+    boundary = content_type.split('boundary=', 1)[1].encode('utf-8')
+    fields = {}
+    files = {}
+    for part in body.split(b'--' + boundary):
+        if not part.startswith(b'\r\n'):
+            continue  # Preamble and the closing '--'
+        head, _, data = part[2:].partition(b'\r\n\r\n')
+        data = data[:-2]  # Trailing CRLF before the next boundary
+        disposition = dict(
+            item.strip().split('=', 1)
+            for item in head.decode('utf-8').split('\r\n')[0].split(';')[1:]
+        )
+        name = disposition['name'].strip('"')
+        if 'filename' in disposition:
+            files[name] = (disposition['filename'].strip('"'), data)
+        else:
+            fields[name] = data.decode('utf-8')
+    return fields, files
+
+
+class StandIn:
+    """Bot API stand-in recording every request; replies are taken from a queue, then 200."""
+
+    def __init__(self):
+        self.requests = []
+        self.replies = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                method = self.path.rsplit('/', 1)[-1]
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('multipart/form-data'):
+                    fields, files = parse_multipart(content_type, body)
+                else:
+                    fields, files = {}, {}
+                stand_in.requests.append({'method': method, 'fields': fields, 'files': files})
+                status, payload = stand_in.replies.pop(0) if stand_in.replies else (200, {'ok': True})
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TelegramMediaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.stand_in = StandIn()
+        patches = [
+            mock.patch.dict(os.environ, {'TELEGRAM_BOT_TOKEN': 'test-token', 'TELEGRAM_CHAT_ID': '42'}),
+            mock.patch.object(telegram_helper, 'TELEGRAM_API_BASE', self.stand_in.url),
+            mock.patch.object(telegram_helper, '_client', None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.stand_in.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def make_file(self, name, size=None, content=None):
+        """Create a media file; size alone makes a sparse file"""
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            if content is not None:
+                f.write(content)
+            else:
+                f.truncate(size)
+        return path
+
+    def test_plan_splits_at_ten_items(self):
+        paths = [self.make_file(f"photo{i:02d}.jpg", content=b'x') for i in range(23)]
+        groups, skipped = plan_media_groups(paths)
+        self.assertEqual([len(group) for group in groups], [10, 10, 3])
+        self.assertEqual(skipped, [])
+        self.assertEqual([item[0] for group in groups for item in group], paths)
+
+    def test_plan_splits_at_request_size(self):
+        paths = [self.make_file(f"video{i}.mp4", size=20 * MB) for i in range(3)]
+        groups, skipped = plan_media_groups(paths)
+        # 40 MB fits one 50 MB request, a third video does not
+        self.assertEqual([len(group) for group in groups], [2, 1])
+        self.assertEqual(skipped, [])
+
+    def test_plan_skips_photos_over_ten_mb(self):
+        big_photo = self.make_file('big.jpg', size=10 * MB + 1)
+        big_video = self.make_file('big.mp4', size=10 * MB + 1)
+        too_big_video = self.make_file('huge.mp4', size=50 * MB + 1)
+        not_media = self.make_file('snaps.jsonl', content=b'{}\n')
+        groups, skipped = plan_media_groups([big_photo, big_video, too_big_video, not_media])
+        self.assertEqual([[item[0] for item in group] for group in groups], [[big_video]])
+        self.assertEqual(skipped, [big_photo, too_big_video, not_media])
+
+    def test_send_media_group_body(self):
+        paths = [
+            self.make_file('a.jpg', content=b'photo-a'),
+            self.make_file('b.mp4', content=b'video-b'),
+            self.make_file('c.png', content=b'photo-c'),
+        ]
+        captions = {paths[0]: 'first', paths[1]: 'x' * 2000}
+        self.assertEqual(send_telegram_media(paths, captions), (3, 0))
+
+        self.assertEqual(len(self.stand_in.requests), 1)
+        request = self.stand_in.requests[0]
+        self.assertEqual(request['method'], 'sendMediaGroup')
+        self.assertEqual(request['fields']['chat_id'], '42')
+        media = json.loads(request['fields']['media'])
+        self.assertEqual([item['type'] for item in media], ['photo', 'video', 'photo'])
+        self.assertEqual(media[0]['caption'], 'first')
+        self.assertEqual(len(media[1]['caption']), telegram_helper.MAX_CAPTION_LENGTH)
+        self.assertNotIn('caption', media[2])
+        # Every attach:// name refers to a file part carrying that file's bytes
+        for item, path in zip(media, paths):
+            self.assertTrue(item['media'].startswith('attach://'))
+            filename, data = request['files'][item['media'][len('attach://'):]]
+            self.assertEqual(filename, os.path.basename(path))
+            with open(path, 'rb') as f:
+                self.assertEqual(data, f.read())
+
+    def test_single_items_use_send_photo_and_send_video(self):
+        photo = self.make_file('only.jpg', content=b'photo')
+        video = self.make_file('only.mp4', content=b'video')
+        self.assertEqual(send_telegram_media([photo], {photo: 'caption'}), (1, 0))
+        self.assertEqual(send_telegram_media([video]), (1, 0))
+
+        photo_request, video_request = self.stand_in.requests
+        self.assertEqual(photo_request['method'], 'sendPhoto')
+        self.assertEqual(photo_request['fields'], {'chat_id': '42', 'caption': 'caption'})
+        self.assertEqual(photo_request['files']['photo'], ('only.jpg', b'photo'))
+        self.assertEqual(video_request['method'], 'sendVideo')
+        self.assertEqual(video_request['files']['video'], ('only.mp4', b'video'))
+
+    def test_retries_after_429(self):
+        paths = [self.make_file(f"p{i}.jpg", content=b'x') for i in range(2)]
+        self.stand_in.replies.append(
+            (429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 0}})
+        )
+        self.assertEqual(send_telegram_media(paths), (2, 0))
+        self.assertEqual([r['method'] for r in self.stand_in.requests], ['sendMediaGroup'] * 2)
+
+    def test_gives_up_after_repeated_429(self):
+        paths = [self.make_file(f"p{i}.jpg", content=b'x') for i in range(2)]
+        self.stand_in.replies.extend(
+            [(429, {'ok': False, 'parameters': {'retry_after': 0}})] * 3
+        )
+        self.assertEqual(send_telegram_media(paths), (0, 2))
+        self.assertEqual(len(self.stand_in.requests), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()